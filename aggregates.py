@@ -0,0 +1,78 @@
+"""
+Maintenance of the `student_subject_aggregates` table.
+
+Write paths call `refresh` inside their own transaction with the students and subjects
+they touched; the affected rows are recomputed from the raw grades in SQL, so the
+table can't drift the way running deltas would. Run `python aggregates.py` to rebuild
+the whole table.
+"""
+from typing import Iterable, Optional
+from sqlalchemy import case, delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+
+Aggregate = models.StudentSubjectAggregate
+
+def grade_percentage():
+    """SQL expression for a grade's percentage, following calculate_gpa's max_score rule."""
+    return case(
+        (models.Assessment.max_score > 0, models.Grade.score / models.Assessment.max_score * 100),
+        else_=models.Grade.score
+    )
+
+def _aggregate_query(student_ids: Optional[Iterable[int]], subject_ids: Optional[Iterable[int]]):
+    pct = grade_percentage()
+    is_weighted = models.Assessment.weight > 0
+    query = (
+        select(
+            models.Grade.student_id,
+            models.Assessment.subject_id,
+            func.sum(case((is_weighted, pct * models.Assessment.weight), else_=0.0)),
+            func.sum(case((is_weighted, models.Assessment.weight), else_=0.0)),
+            func.sum(case((is_weighted, 0.0), else_=pct)),
+            func.sum(case((is_weighted, 0), else_=1)),
+            func.count(models.Grade.id),
+            func.max(models.Grade.score),
+            func.min(models.Grade.score),
+        )
+        .join(models.Assessment, models.Grade.assessment_id == models.Assessment.id)
+        .group_by(models.Grade.student_id, models.Assessment.subject_id)
+    )
+    if student_ids is not None:
+        query = query.where(models.Grade.student_id.in_(student_ids))
+    if subject_ids is not None:
+        query = query.where(models.Assessment.subject_id.in_(subject_ids))
+    return query
+
+def _refresh_statements(student_ids: Optional[Iterable[int]] = None, subject_ids: Optional[Iterable[int]] = None):
+    """DELETE then INSERT ... SELECT for every (student, subject) pair in the given sets (None = all)."""
+    student_ids = None if student_ids is None else sorted(set(student_ids))
+    subject_ids = None if subject_ids is None else sorted(set(subject_ids))
+    clear = delete(Aggregate)
+    if student_ids is not None:
+        clear = clear.where(Aggregate.student_id.in_(student_ids))
+    if subject_ids is not None:
+        clear = clear.where(Aggregate.subject_id.in_(subject_ids))
+    fill = insert(Aggregate).from_select(
+        ["student_id", "subject_id", "weighted_sum", "weight_sum", "unweighted_sum",
+         "unweighted_count", "graded_count", "best_score", "worst_score"],
+        _aggregate_query(student_ids, subject_ids)
+    )
+    return clear, fill
+
+async def refresh(db: AsyncSession, student_ids: Optional[Iterable[int]] = None, subject_ids: Optional[Iterable[int]] = None):
+    """Recompute aggregates for the given students and/or subjects. The caller commits."""
+    for stmt in _refresh_statements(student_ids, subject_ids):
+        await db.execute(stmt)
+
+def rebuild(conn):
+    """Recompute the whole table on a sync connection or session."""
+    for stmt in _refresh_statements():
+        conn.execute(stmt)
+
+if __name__ == "__main__":
+    from database import engine
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        rebuild(conn)
+    print("Rebuilt student_subject_aggregates.")
@@ -0,0 +1,193 @@
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
+from sqlalchemy import func, insert, select, update, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Iterable, List, Optional, Set
+
+import models
+import schemas
+import auth
+import aggregates
+import data_versions
+import notifications
+import orphans
+import rankings
+from database import get_async_db, get_async_read_db
+
+router = APIRouter(
+    prefix="/assessments",
+    tags=["assessments"]
+)
+
+# Largest total weight the assessments of one subject may add up to
+MAX_SUBJECT_WEIGHT = 100.0
+
+Assessment = models.Assessment
+
+async def _require_subjects(db: AsyncSession, subject_ids: Iterable[int]):
+    subject_ids = set(subject_ids)
+    result = await db.execute(select(models.Subject.id).where(models.Subject.id.in_(subject_ids)))
+    missing = sorted(subject_ids - set(result.scalars().all()))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Subjects not found: {missing}")
+
+async def _check_weights(db: AsyncSession, subject_ids: Iterable[int]):
+    """
+    Fail the request if any of these subjects' assessment weights now total more than 100.
+    Summed in SQL on the uncommitted state, so the caller's transaction is rolled back.
+    """
+    result = await db.execute(
+        select(Assessment.subject_id, func.sum(Assessment.weight))
+        .where(Assessment.subject_id.in_(set(subject_ids)))
+        .group_by(Assessment.subject_id)
+        .having(func.sum(Assessment.weight) > MAX_SUBJECT_WEIGHT + 1e-9)
+    )
+    over = result.all()
+    if over:
+        await db.rollback()
+        details = ", ".join(f"subject {subject_id}: {total:g}" for subject_id, total in over)
+        raise HTTPException(status_code=400, detail=f"Assessment weights per subject must total at most 100 ({details})")
+
+def _drop_rankings(subject_ids: Iterable[int]):
+    # Weight changes move every student's percentage, so reload the indexes lazily
+    for subject_id in set(subject_ids):
+        rankings.drop_subject(subject_id)
+
+@router.get("/", response_model=List[schemas.Assessment])
+async def get_assessments(subject_id: Optional[int] = None, db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(auth.get_current_user)):
+    query = select(Assessment).order_by(Assessment.subject_id, Assessment.id)
+    if subject_id is not None:
+        query = query.where(Assessment.subject_id == subject_id)
+    result = await db.execute(query)
+    return result.scalars().all()
+
+@router.post("/batch", response_model=List[schemas.Assessment], status_code=status.HTTP_201_CREATED)
+async def create_assessments(assessments: List[schemas.AssessmentCreate], db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(auth.require_lecturer)):
+    """Creates all the given assessments in one transaction, or none of them."""
+    if not assessments:
+        return []
+    subject_ids = {a.subject_id for a in assessments}
+    await _require_subjects(db, subject_ids)
+    result = await db.execute(
+        insert(Assessment).returning(Assessment, sort_by_parameter_order=True),
+        [a.model_dump() for a in assessments]
+    )
+    created = result.scalars().all()
+    await _check_weights(db, subject_ids)
+    await db.commit()
+    await notifications.publish({
+        "type": "assessments.created",
+        "assessment_ids": [a.id for a in created],
+        "subject_ids": sorted(subject_ids),
+    })
+    return created
+
+@router.put("/batch", response_model=List[schemas.Assessment])
+async def update_assessments(assessments: List[schemas.AssessmentUpdate], db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(auth.require_lecturer)):
+    """Updates all the given assessments in one transaction, or none of them."""
+    if not assessments:
+        return []
+    ids = [a.id for a in assessments]
+    result = await db.execute(select(Assessment.id, Assessment.subject_id).where(Assessment.id.in_(ids)))
+    old_subjects = dict(result.all())
+    missing = sorted(set(ids) - set(old_subjects))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Assessments not found: {missing}")
+    new_subject_ids = {a.subject_id for a in assessments}
+    await _require_subjects(db, new_subject_ids)
+
+    await db.execute(update(Assessment), [a.model_dump() for a in assessments])
+    # Weights, max scores or subjects may have changed for everyone graded on these
+    subject_ids = set(old_subjects.values()) | new_subject_ids
+    await data_versions.bump_assessments(db, ids)
+    # a subject move changes which grades a subject-filtered grade listing returns
+    await data_versions.bump_resources(db, "grades")
+    await aggregates.refresh(db, subject_ids=subject_ids)
+    await _check_weights(db, new_subject_ids)
+    await db.commit()
+    _drop_rankings(subject_ids)
+    await notifications.publish({
+        "type": "assessments.updated",
+        "assessment_ids": ids,
+        "subject_ids": sorted(subject_ids),
+    })
+    result = await db.execute(select(Assessment).where(Assessment.id.in_(ids)).execution_options(populate_existing=True))
+    by_id = {a.id: a for a in result.scalars().all()}
+    return [by_id[i] for i in ids]
+
+@router.delete("/", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_assessments(background_tasks: BackgroundTasks, ids: List[int] = Query(...), db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(auth.require_lecturer)):
+    """
+    Deletes the given assessments and their grades in one transaction. As with subjects,
+    grades beyond DELETE_CHUNK_SIZE are deleted in chunks after the response, and the
+    assessments themselves with the last chunk.
+    """
+    result = await db.execute(select(Assessment.id, Assessment.subject_id).where(Assessment.id.in_(ids)))
+    subjects = dict(result.all())
+    missing = sorted(set(ids) - set(subjects))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Assessments not found: {missing}")
+
+    ids = sorted(set(ids))
+    subject_ids = set(subjects.values())
+    await data_versions.bump_assessments(db, ids)
+    deleted = await orphans.delete_grades_chunk(db, ids)
+    if deleted == orphans.CHUNK_SIZE:
+        await aggregates.refresh(db, subject_ids=subject_ids)
+        await db.commit()
+        background_tasks.add_task(_finish_delete_assessments, ids, subject_ids)
+        return
+    await _delete_assessment_rows(db, ids, subject_ids)
+    await db.commit()
+    await _assessments_deleted(ids, subject_ids)
+    return
+
+async def _delete_assessment_rows(db: AsyncSession, ids: List[int], subject_ids: Set[int]):
+    # the caller has deleted every grade of these assessments
+    await db.execute(delete(Assessment).where(Assessment.id.in_(ids)))
+    await aggregates.refresh(db, subject_ids=subject_ids)
+    await data_versions.bump_resources(db, "grades")
+
+async def _assessments_deleted(ids: List[int], subject_ids: Set[int]):
+    _drop_rankings(subject_ids)
+    await notifications.publish({
+        "type": "assessments.deleted",
+        "assessment_ids": ids,
+        "subject_ids": sorted(subject_ids),
+    })
+
+async def _finish_delete_assessments(ids: List[int], subject_ids: Set[int]):
+    await orphans.delete_grades(ids, finish=lambda db: _delete_assessment_rows(db, ids, subject_ids))
+    await _assessments_deleted(ids, subject_ids)
+
+@router.post("/clone", response_model=List[schemas.Assessment], status_code=status.HTTP_201_CREATED)
+async def clone_assessments(request: schemas.AssessmentCloneRequest, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(auth.require_lecturer)):
+    """
+    Copies the source subject's assessment scheme (names, max scores, weights) into every
+    target subject with a single INSERT ... SELECT.
+    """
+    target_ids = set(request.target_subject_ids)
+    if not target_ids:
+        return []
+    await _require_subjects(db, target_ids | {request.source_subject_id})
+    # source assessments x target subjects
+    scheme = (
+        select(models.Subject.id, Assessment.name, Assessment.max_score, Assessment.weight)
+        .join(models.Subject, models.Subject.id.in_(target_ids))
+        .where(Assessment.subject_id == request.source_subject_id)
+        .order_by(models.Subject.id, Assessment.id)
+    )
+    result = await db.execute(
+        insert(Assessment)
+        .from_select(["subject_id", "name", "max_score", "weight"], scheme)
+        .returning(Assessment.id, Assessment.subject_id, Assessment.name, Assessment.max_score, Assessment.weight)
+    )
+    created = [schemas.Assessment(**row) for row in result.mappings().all()]
+    await _check_weights(db, target_ids)
+    await db.commit()
+    if created:
+        await notifications.publish({
+            "type": "assessments.created",
+            "assessment_ids": [a.id for a in created],
+            "subject_ids": sorted(target_ids),
+        })
+    return sorted(created, key=lambda a: (a.subject_id, a.id))
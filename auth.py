@@ -1,11 +1,17 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 import bcrypt
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import models, schemas, database
+from cache import LRUCache
 
 # SECRET_KEY should be in env vars in production
 SECRET_KEY = "supersecretkey"
@@ -15,11 +21,90 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Resolved users keyed by token subject (username). The TTL bounds how long another worker
+# process can keep serving a user that was changed elsewhere.
+user_cache = LRUCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("USER_CACHE_TTL_SECONDS", "60")),
+)
+
+def invalidate_user(username: str):
+    user_cache.invalidate(username)
+
+# Users changed in a session are evicted once its transaction commits: evicting at flush
+# time would let a concurrent request re-cache the old row before the commit, and would
+# evict for changes that end up rolled back.
+_PENDING_EVICTIONS = "user_cache_evictions"
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _record_changed_user(mapper, connection, target):
+    state = inspect(target)
+    pending = state.session.info.setdefault(_PENDING_EVICTIONS, set())
+    pending.add(target.username)
+    # a rename leaves the old subject cached as well
+    pending.update(state.attrs.username.history.deleted or ())
+
+@event.listens_for(Session, "after_commit")
+def _evict_committed_users(session):
+    if session.in_nested_transaction():
+        # a released savepoint; the outer transaction may still roll back
+        return
+    for username in session.info.pop(_PENDING_EVICTIONS, ()):
+        invalidate_user(username)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back_users(session, previous_transaction):
+    # a savepoint rollback keeps the outer transaction's changes
+    if not previous_transaction.nested:
+        session.info.pop(_PENDING_EVICTIONS, None)
+
+# bcrypt work factor for new hashes; stored hashes with a different cost are upgraded on login.
+# Pick it from `python bench_login.py` on the production hardware.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt releases the GIL, so a small dedicated pool hashes in parallel without starving
+# the request threadpool; extra logins queue here instead of pinning every core.
+BCRYPT_MAX_CONCURRENCY = int(os.getenv("BCRYPT_MAX_CONCURRENCY", str(os.cpu_count() or 1)))
+_hash_executor = ThreadPoolExecutor(max_workers=BCRYPT_MAX_CONCURRENCY, thread_name_prefix="bcrypt")
+
 def verify_password(plain_password, hashed_password):
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 def get_password_hash(password):
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+async def verify_password_async(plain_password, hashed_password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, get_password_hash, password)
+
+def hash_cost(hashed_password: str) -> Optional[int]:
+    """Work factor of a stored bcrypt hash ("$2b$12$..." -> 12), or None if unrecognised."""
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+def needs_rehash(hashed_password: str) -> bool:
+    return hash_cost(hashed_password) != BCRYPT_ROUNDS
+
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    """
+    Check a username/password pair for login, returning the user or None.
+    On success, a hash stored with a different work factor is replaced with one at
+    BCRYPT_ROUNDS, while the plain password is at hand.
+    """
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    user = result.scalars().first()
+    if user is None or not await verify_password_async(password, user.hashed_password):
+        return None
+    if needs_rehash(user.hashed_password):
+        user.hashed_password = await get_password_hash_async(password)
+        await db.commit()
+    return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -31,7 +116,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+async def authenticate_token(token: str, db: AsyncSession):
+    """Resolve a bearer token to its user, raising 401 if the token or user is invalid."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -45,7 +131,32 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = schemas.TokenData(username=username)
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
+
+    cached = user_cache.get(token_data.username)
+    if cached is not None:
+        # Detached copy with the columns routes rely on; it is never added to a session.
+        return models.User(**cached)
+
+    result = await db.execute(select(models.User).where(models.User.username == token_data.username))
+    user = result.scalars().first()
     if user is None:
         raise credentials_exception
+    user_cache.set(token_data.username, {
+        "id": user.id,
+        "username": user.username,
+        "role": user.role,
+        "student_number": user.student_number,
+    })
     return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_async_read_db)):
+    return await authenticate_token(token, db)
+
+def require_lecturer(current_user: models.User = Depends(get_current_user)):
+    """Dependency to ensure the current user is a lecturer."""
+    if current_user.role != schemas.UserRole.lecturer:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Operation not permitted. Only lecturers can perform this action."
+        )
+    return current_user
@@ -0,0 +1,181 @@
+"""
+Intent dispatch micro-benchmark for the chatbot.
+
+Compares the original chain of module-level re.search calls (a regex cache lookup per
+pattern per message) and a single combined alternation with chatbot.match_intent's table
+of patterns compiled at import, over a corpus of realistic student messages. Each one does
+everything up to the handler's first query (picking the intent, extracting its groups and
+splitting subject names from codes), and all three must produce the same result. Timings
+are the median of several interleaved runs.
+
+With --queries it instead checks that answering subject questions stays within a fixed
+number of SQL statements against the configured database (seed it first with
+seed_data.py), exiting non-zero on a regression such as a per-subject N+1.
+
+Usage: python bench_chatbot.py [iterations] [runs]
+       python bench_chatbot.py --queries
+"""
+import asyncio
+import re
+import statistics
+import sys
+import time
+from sqlalchemy import event, select
+import chatbot
+import models
+import subject_index
+from database import AsyncReadSessionLocal, async_read_engine
+
+QUERIES = [
+    "What is my grade in Mathematics?",
+    "Show my grades for MATH101 this semester.",
+    "What is my current grade in MATH101?",
+    "grades for Mathematics (MATH101)",
+    "What's my rank in Physics?",
+    "Where am I ranked in Computer Science?",
+    "How am I performing?",
+    "Give me a performance summary",
+    "What do I need to get a B in physics?",
+    "What do I need?",
+    "My GPA",
+    "Recent grades",
+    "Study plan for MATH101",
+    "Create a 4-week study plan to reach 80% in Calculus.",
+    "Show the available subjects and their codes.",
+    "If I get 80% on the final (40% weight), what will my overall grade be?",
+]
+
+def legacy_match(query: str):
+    """
+    The if-chain process_query used before the dispatch table, including the group
+    extraction and subject-name/code split it did before touching the database. The
+    rank and plan intents, added later, follow the same style.
+    """
+    match_grade = re.search(r"grades? (?:in|for) (.+)", query)
+    if match_grade:
+        raw_subject = match_grade.group(1).strip("?").strip()
+        name_part = raw_subject
+        code_part = None
+        m = re.match(r"^(.+?)\s*\(([^)]+)\)$", raw_subject)
+        if m:
+            name_part = m.group(1).strip()
+            code_part = m.group(2).strip()
+        else:
+            parts = raw_subject.split()
+            if len(parts) > 1 and re.fullmatch(r"[A-Za-z0-9]+", parts[-1]):
+                code_part = parts[-1].strip()
+                name_part = " ".join(parts[:-1]).strip()
+        return "grades", (name_part, code_part)
+    match_rank = re.search(r"\brank(?:ed|ing)? (?:in|for) (.+)", query)
+    if match_rank:
+        return "rank", (match_rank.group(1).strip("?").strip(),)
+    if "performing" in query or "performance" in query or "summary" in query:
+        return "performance", ()
+    match_prediction = re.search(r"need.*get a ([a-f]) in (.+)", query)
+    if match_prediction:
+        return "prediction", (match_prediction.group(1).upper(), match_prediction.group(2).strip("?").strip())
+    if re.search(r"what do i need\b", query):
+        return "plan", ()
+    return None
+
+def _extract(name: str, params: dict):
+    """What the handler takes from an intent's parameters before its first query."""
+    if name == "grades":
+        return name, chatbot.split_subject(params["subject"])
+    if name == "rank":
+        return name, (params["subject"],)
+    if name == "prediction":
+        return name, (params["grade"].upper(), params["subject"])
+    return name, ()
+
+_combined = None
+
+def combined_match(query: str):
+    """One alternation over every intent, leftmost match checked against earlier intents."""
+    global _combined
+    if _combined is None:
+        branches = []
+        for i, registered in enumerate(chatbot._intents):
+            body = re.sub(r"\(\?P<(\w+)>", lambda m: f"(?P<i{i}_{m.group(1)}>", registered.pattern.pattern)
+            branches.append(f"(?P<i{i}>{body})")
+        _combined = re.compile("|".join(branches))
+    m = _combined.search(query)
+    if m is None:
+        return None
+    k = int(m.lastgroup[1:])
+    for registered in chatbot._intents[:k]:
+        earlier = registered.pattern.search(query, m.start())
+        if earlier:
+            return _extract(registered.name, {n: " ".join(v.strip("?").split()) for n, v in earlier.groupdict().items()})
+    prefix = f"i{k}_"
+    params = {n[len(prefix):]: " ".join(v.strip("?").split()) for n, v in m.groupdict().items()
+              if n.startswith(prefix) and v is not None}
+    return _extract(chatbot._intents[k].name, params)
+
+def dispatch_match(query: str):
+    matched = chatbot.match_intent(query)
+    if matched is None:
+        return None
+    registered, params = matched
+    return _extract(registered.name, params)
+
+def bench(fn, queries, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for q in queries:
+            fn(q)
+    return time.perf_counter() - started
+
+# Most SQL statements each answer may issue once the subject index is loaded. This is a
+# smoke check against the configured database; test_chatbot.py pins the exact counts.
+QUERY_BUDGETS = {
+    "what is my grade in mathematics?": 1,
+    "grades in science": 1,
+    "grades for physics (phys101)": 1,
+    "grades in phisics": 1,
+    "grades in nonexistent subject xyz": 0,
+}
+
+async def check_query_counts() -> bool:
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    async with AsyncReadSessionLocal() as db:
+        student_id = (await db.execute(
+            select(models.User.id).where(models.User.role == "student").limit(1)
+        )).scalar()
+        await subject_index.load(db)
+        event.listen(async_read_engine.sync_engine, "before_cursor_execute", listener)
+        try:
+            ok = True
+            for query, budget in QUERY_BUDGETS.items():
+                statements.clear()
+                await chatbot.process_query(query, db, student_id)
+                status = "ok" if len(statements) <= budget else "OVER BUDGET"
+                ok = ok and len(statements) <= budget
+                print(f"{query!r:>40}: {len(statements)} queries (budget {budget}) {status}")
+            return ok
+        finally:
+            event.remove(async_read_engine.sync_engine, "before_cursor_execute", listener)
+
+def main():
+    if "--queries" in sys.argv[1:]:
+        sys.exit(0 if asyncio.run(check_query_counts()) else 1)
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 9
+    queries = [q.lower() for q in QUERIES]
+    for q in queries:
+        assert legacy_match(q) == combined_match(q) == dispatch_match(q), q
+    approaches = (("re.search chain", legacy_match), ("combined alternation", combined_match),
+                  ("precompiled table", dispatch_match))
+    total = iterations * len(queries)
+    timings = {label: [] for label, _ in approaches}
+    # interleave the approaches so drift in machine load affects each one alike
+    for _ in range(repeats):
+        for label, fn in approaches:
+            timings[label].append(bench(fn, queries, iterations) * 1e6 / total)
+    print(f"{len(queries)} queries x {iterations} iterations, median of {repeats} runs")
+    for label, runs in timings.items():
+        print(f"{label:>22}: {statistics.median(runs):7.2f} us/message (min {min(runs):.2f}, max {max(runs):.2f})")
+
+if __name__ == "__main__":
+    main()
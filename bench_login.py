@@ -0,0 +1,44 @@
+"""
+Login throughput benchmark for choosing BCRYPT_ROUNDS.
+
+For each work factor it measures single-hash latency and how many password checks per
+second the bcrypt executor sustains under a burst of concurrent logins.
+
+Usage: python bench_login.py [burst_size] [rounds ...]
+    e.g. python bench_login.py 64 10 11 12 13
+"""
+import asyncio
+import sys
+import time
+import bcrypt
+import auth
+
+async def _burst(hashed: str, burst_size: int) -> float:
+    started = time.perf_counter()
+    await asyncio.gather(*(auth.verify_password_async("correct horse", hashed) for _ in range(burst_size)))
+    return time.perf_counter() - started
+
+def bench(rounds: int, burst_size: int) -> dict:
+    hashed = bcrypt.hashpw(b"correct horse", bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+    started = time.perf_counter()
+    auth.verify_password("correct horse", hashed)
+    latency = time.perf_counter() - started
+    elapsed = asyncio.run(_burst(hashed, burst_size))
+    return {
+        "rounds": rounds,
+        "latency_ms": latency * 1000,
+        "logins_per_sec": burst_size / elapsed,
+        "burst_ms": elapsed * 1000,
+    }
+
+def main():
+    burst_size = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    rounds_list = [int(r) for r in sys.argv[2:]] or [10, 11, 12, 13]
+    print(f"bcrypt executor workers: {auth.BCRYPT_MAX_CONCURRENCY}, burst size: {burst_size}")
+    print(f"{'rounds':>6} {'1 check (ms)':>13} {'logins/sec':>11} {'burst (ms)':>11}")
+    for rounds in rounds_list:
+        r = bench(rounds, burst_size)
+        print(f"{r['rounds']:>6} {r['latency_ms']:>13.1f} {r['logins_per_sec']:>11.1f} {r['burst_ms']:>11.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends
+
+import models
+import auth
+import chat
+import logic
+
+router = APIRouter(
+    prefix="/cache",
+    tags=["cache"]
+)
+
+# In-process caches reported by GET /cache/stats
+CACHES = {
+    "users": auth.user_cache,
+    "chat_answers": chat.answer_cache,
+    "results": logic.result_cache,
+}
+
+@router.get("/stats")
+def get_cache_stats(current_user: models.User = Depends(auth.require_lecturer)):
+    """Size and hit-rate counters of each of this worker's caches."""
+    return {name: cache.stats() for name, cache in CACHES.items()}
@@ -1,23 +1,117 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-import models, schemas, database, auth, chatbot
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator, Optional
+import models, schemas, database, auth, chatbot, data_versions
+import json
 import os
-from fastapi.responses import JSONResponse
+import traceback
+from fastapi.responses import JSONResponse, StreamingResponse
+from cache import LRUCache
 
 router = APIRouter(
     tags=["Chat"]
 )
 
+# Most questions accepted by one /chat/batch request
+MAX_BATCH_MESSAGES = int(os.getenv("CHAT_MAX_BATCH_MESSAGES", "20"))
+
+# Answers keyed by (user, intent, parameters, data version); a new grade changes the
+# version so stale answers are never served, and the TTL bounds staleness from changes
+# the version does not track (subject or assessment renames).
+answer_cache = LRUCache(
+    maxsize=int(os.getenv("CHAT_CACHE_SIZE", "5000")),
+    ttl=float(os.getenv("CHAT_CACHE_TTL_SECONDS", "300")),
+)
+
+async def stream_answer(message: str, db: AsyncSession, user_id: int, version: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    `chatbot.stream_query`, served from `answer_cache` for cacheable intents. A cache hit
+    arrives as one piece; a miss is streamed as it is computed and cached once complete.
+    Pass the student's data `version` when it is already known to skip looking it up.
+    """
+    matched = chatbot.match_intent(message.lower())
+    if matched is None:
+        yield chatbot.FALLBACK_RESPONSE
+        return
+    registered, params = matched
+    if not registered.cacheable:
+        async for piece in chatbot.stream_answer(registered, params, db, user_id):
+            yield piece
+        return
+    if version is None:
+        version = await data_versions.get_version(db, user_id)
+    key = (user_id, registered.name, tuple(sorted(params.items())), version)
+    response_text = answer_cache.get(key)
+    if response_text is not None:
+        yield response_text
+        return
+    pieces = []
+    async for piece in chatbot.stream_answer(registered, params, db, user_id):
+        pieces.append(piece)
+        yield piece
+    answer_cache.set(key, "".join(pieces))
+
+async def answer(message: str, db: AsyncSession, user_id: int, version: Optional[int] = None) -> str:
+    return "".join([piece async for piece in stream_answer(message, db, user_id, version)])
+
 @router.post("/chat", response_model=schemas.ChatResponse)
-def chat_with_bot(request: schemas.ChatRequest, db: Session = Depends(database.get_db), current_user: models.User = Depends(auth.get_current_user)):
+async def chat_with_bot(request: schemas.ChatRequest, db: AsyncSession = Depends(database.get_async_read_db), current_user: models.User = Depends(auth.get_current_user)):
     try:
-        response_text = chatbot.process_query(request.message, db, current_user.id)
+        response_text = await answer(request.message, db, current_user.id)
         return {"response": response_text}
     except Exception as e:
-        import traceback
         traceback.print_exc()
         return {"response": f"I encountered an internal error: {str(e)}"}
 
+@router.post("/chat/batch", response_model=schemas.ChatBatchResponse)
+async def chat_with_bot_batch(request: schemas.ChatBatchRequest, db: AsyncSession = Depends(database.get_async_read_db), current_user: models.User = Depends(auth.get_current_user)):
+    """
+    Answer several questions in one round trip, in order. The user is authenticated once,
+    the student's data version is looked up once, and every answer is read inside one
+    read transaction, so grades committed mid-batch never show up in only some answers.
+    """
+    if len(request.messages) > MAX_BATCH_MESSAGES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_MESSAGES} messages per batch")
+    await database.begin_read_snapshot(db)
+    version = await data_versions.get_version(db, current_user.id)
+    responses = []
+    for message in request.messages:
+        try:
+            responses.append(await answer(message, db, current_user.id, version))
+        except Exception as e:
+            traceback.print_exc()
+            responses.append(f"I encountered an internal error: {str(e)}")
+    return {"responses": responses}
+
+async def _sse_answer(message: str, user_id: int):
+    # The request-scoped session may be closed before the body is sent, so the stream owns its own.
+    async with database.AsyncReadSessionLocal() as db:
+        try:
+            async for piece in stream_answer(message, db, user_id):
+                yield f"data: {json.dumps({'delta': piece})}\n\n"
+        except Exception as e:
+            traceback.print_exc()
+            yield f"event: error\ndata: {json.dumps({'response': f'I encountered an internal error: {str(e)}'})}\n\n"
+            return
+    yield "event: done\ndata: {}\n\n"
+
+@router.post("/chat/stream")
+async def chat_with_bot_stream(request: schemas.ChatRequest, current_user: models.User = Depends(auth.get_current_user)):
+    """
+    Server-sent events version of /chat: each `data` event carries a `delta` to append to
+    the answer (one per subject block on multi-subject answers), then a `done` event.
+    """
+    return StreamingResponse(
+        _sse_answer(request.message, current_user.id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/chat/cache")
+def get_answer_cache_stats(current_user: models.User = Depends(auth.require_lecturer)):
+    """Size and hit-rate counters of this worker's chat answer cache."""
+    return answer_cache.stats()
+
 
 @router.get("/prompts")
 def get_prompts():
@@ -1,137 +1,225 @@
 import re
-from sqlalchemy.orm import Session
+from typing import AsyncIterator, Callable, List, NamedTuple, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import logic
 import models
+import rankings
+import subject_index
 
-def process_query(query: str, db: Session, user_id: int) -> str:
-    query = query.lower()
-    
-    # Pattern: "What is my grade in [Subject]?"
-    # Improved regex to handle "grade for", "grades in", "grades for"
-    match_grade = re.search(r"grades? (?:in|for) (.+)", query)
-    if match_grade:
-        raw_subject = match_grade.group(1).strip("?").strip()
-
-        # Try to extract a subject name and optional code e.g. "Mathematics (MATH101)" or "Mathematics MATH101"
-        name_part = raw_subject
-        code_part = None
-        m = re.match(r"^(.+?)\s*\(([^)]+)\)$", raw_subject)
-        if m:
-            name_part = m.group(1).strip()
-            code_part = m.group(2).strip()
-        else:
-            # also accept formats like "Mathematics MATH101"
-            parts = raw_subject.split()
-            if len(parts) > 1 and re.fullmatch(r"[A-Za-z0-9]+", parts[-1]):
-                code_part = parts[-1].strip()
-                name_part = " ".join(parts[:-1]).strip()
-
-        # 1. Find the subject(s) first: search by name or code when available
-        query_filter = models.Subject.name.ilike(f"%{name_part}%")
-        if code_part:
-            subjects = db.query(models.Subject).filter(
-                (models.Subject.name.ilike(f"%{name_part}%")) | (models.Subject.code.ilike(f"%{code_part}%"))
-            ).all()
-        else:
-            subjects = db.query(models.Subject).filter(query_filter).all()
+FALLBACK_RESPONSE = "I'm not sure I understand. Try asking about your grades in a specific subject or your overall performance."
 
-        if not subjects:
-            return f"I couldn't find any subject matching '{raw_subject}'."
-            
-        response_parts = []
-        
-        for subject in subjects:
-            # 2. Find grades for this subject
-            grades = db.query(models.Grade).join(models.Assessment).filter(
-                models.Grade.student_id == user_id,
-                models.Assessment.subject_id == subject.id
-            ).all()
-            
-            if grades:
-                part = f"**{subject.name}** ({subject.code}):\n"
-                total_score = 0
-                total_weight = 0
-                
-                for grade in grades:
-                    part += f"- {grade.assessment.name}: {grade.score} ({logic.calculate_grade_letter(grade.score)})\n"
-                    total_score += grade.score * (grade.assessment.weight / 100)
-                    total_weight += grade.assessment.weight
-                
-                part += f"Current Weighted Score: {total_score:.1f} (out of {total_weight} weight so far)\n"
-                response_parts.append(part)
-            else:
-                # 3. If no grades, check for assessments
-                assessments = db.query(models.Assessment).filter(
-                    models.Assessment.subject_id == subject.id
-                ).all()
-                
-                if assessments:
-                    assessment_names = ", ".join([f"{a.name} ({a.weight}%)" for a in assessments])
-                    response_parts.append(f"**{subject.name}**: No grades recorded yet. Assessments: {assessment_names}.")
-                else:
-                    response_parts.append(f"**{subject.name}**: No grades or assessments found.")
-
-        return "\n".join(response_parts)
-
-    # Pattern: "How am I performing?"
-    if "performing" in query or "performance" in query or "summary" in query:
-        stats = logic.get_student_performance_summary(db, user_id)
-        if isinstance(stats, str): return stats
-        return (f"Performance Summary:\n"
-                f"GPA: {stats['gpa']}\n"
-                f"Best Subject: {stats['best_subject']}\n"
-                f"Needs Improvement: {stats['worst_subject']}")
-
-    # Pattern: "What do I need to score to get a [Grade]?"
-    # This is tricky without context of which subject. 
-    # We'll assume the user might say "What do I need for an A in Math?"
-    match_prediction = re.search(r"need.*get a ([a-f]) in (.+)", query)
-    if match_prediction:
-        target_grade = match_prediction.group(1).upper()
-        subject_name = match_prediction.group(2).strip("?").strip()
-        
-        # Get current standing
-        grades = db.query(models.Grade).join(models.Assessment).join(models.Subject).filter(
-            models.Grade.student_id == user_id,
-            models.Subject.name.ilike(f"%{subject_name}%")
-        ).all()
-        
-        if not grades:
-            return f"No grades found for {subject_name} to base a prediction on."
-            
-        current_weighted_score = sum(g.score * (g.assessment.weight / 100) for g in grades)
-        current_total_weight = sum(g.assessment.weight for g in grades)
-        
-        # Normalize current score to 100 scale for the function if needed, 
-        # but logic.predict_grade_needed takes current_score as raw average? 
-        # Actually logic.predict_grade_needed logic is a bit specific.
-        # Let's use the weighted sum directly.
-        
-        # If we have 60% of the course done, and we have 50 points so far.
-        # We need X points in the remaining 40%.
-        # Target for A is 90 points total.
-        # 90 - 50 = 40 needed.
-        # 40 points out of 40% weight = 100% score needed.
-        
-        target_score = 0
-        if target_grade == "A": target_score = 90
-        elif target_grade == "B": target_score = 80
-        elif target_grade == "C": target_score = 70
-        elif target_grade == "D": target_score = 60
+# Handlers are async generators yielding the answer's blocks (paragraphs or lines) as soon as
+# each one is ready; the full answer is the blocks joined with newlines.
+Handler = Callable[[dict, AsyncSession, int], AsyncIterator[str]]
+
+class Intent(NamedTuple):
+    name: str
+    pattern: re.Pattern
+    handler: Handler
+    # False when the answer depends on other students' data (not covered by the asker's data version)
+    cacheable: bool = True
+
+# Registered intents in priority order; see `intent`.
+_intents: List[Intent] = []
+
+def intent(name: str, pattern: str, cacheable: bool = True):
+    """
+    Register an intent handler. `pattern` is compiled once here and searched for in the
+    lowercased message; its named groups are passed to the handler as parameters (with "?"
+    stripped and whitespace collapsed). Intents are tried in registration order and the
+    first match wins. Mark an intent `cacheable=False` if its answer depends on more than
+    the asking student's own data.
+    """
+    def register(handler: Handler) -> Handler:
+        _intents.append(Intent(name, re.compile(pattern), handler, cacheable))
+        return handler
+    return register
+
+def match_intent(query: str) -> Optional[Tuple[Intent, dict]]:
+    """Return the first registered intent matching `query` (already lowercased) and its parameters."""
+    for registered in _intents:
+        m = registered.pattern.search(query)
+        if m is not None:
+            params = {
+                name: " ".join(value.strip("?").split())
+                for name, value in m.groupdict().items() if value is not None
+            }
+            return registered, params
+    return None
+
+# Subject phrases like "Mathematics (MATH101)" or "Mathematics MATH101"
+_SUBJECT_WITH_CODE = re.compile(r"^(.+?)\s*\(([^)]+)\)$")
+_CODE_TOKEN = re.compile(r"[A-Za-z0-9]+")
+
+def split_subject(raw_subject: str) -> Tuple[str, Optional[str]]:
+    """Split a subject phrase into (name_part, code_part); code_part is None when absent."""
+    m = _SUBJECT_WITH_CODE.match(raw_subject)
+    if m:
+        return m.group(1).strip(), m.group(2).strip()
+    # also accept formats like "Mathematics MATH101"
+    parts = raw_subject.split()
+    if len(parts) > 1 and _CODE_TOKEN.fullmatch(parts[-1]):
+        return " ".join(parts[:-1]).strip(), parts[-1].strip()
+    return raw_subject, None
+
+# Pattern: "What is my grade in [Subject]?"
+# Improved regex to handle "grade for", "grades in", "grades for"
+@intent("grades", r"grades? (?:in|for) (?P<subject>.+)")
+async def answer_grades(params: dict, db: AsyncSession, user_id: int) -> AsyncIterator[str]:
+    raw_subject = params["subject"]
+    name_part, code_part = split_subject(raw_subject)
+
+    # 1. Find the subject(s) first: search by name or code when available
+    subjects = (await subject_index.get_index(db)).search(name_part, code_part)
+
+    if not subjects:
+        yield f"I couldn't find any subject matching '{raw_subject}'."
+        return
         
-        needed_points = target_score - current_weighted_score
-        remaining_weight = 100 - current_total_weight
+    # 2. One query for every matched subject's assessments, outer-joined to this student's
+    # grades, streamed in subject order so each block is sent once its rows are in
+    result = await db.stream(
+        select(models.Assessment.subject_id, models.Assessment.name, models.Assessment.weight, models.Grade.score)
+        .outerjoin(models.Grade, (models.Grade.assessment_id == models.Assessment.id) & (models.Grade.student_id == user_id))
+        .where(models.Assessment.subject_id.in_([subject.id for subject in subjects]))
+        .order_by(models.Assessment.subject_id, models.Grade.id, models.Assessment.id)
+    )
+    pending = iter(sorted(subjects, key=lambda subject: subject.id))
+    async for subject_id, rows in _group_by_subject(result):
+        for subject in pending:
+            if subject.id == subject_id:
+                yield _grades_block(subject, rows)
+                break
+            yield _grades_block(subject, [])
+    for subject in pending:
+        yield _grades_block(subject, [])
+
+async def _group_by_subject(result) -> AsyncIterator[Tuple[int, list]]:
+    """Consecutive runs of streamed rows sharing a subject_id."""
+    subject_id, rows = None, []
+    async for row in result:
+        if row.subject_id != subject_id and rows:
+            yield subject_id, rows
+            rows = []
+        subject_id = row.subject_id
+        rows.append(row)
+    if rows:
+        yield subject_id, rows
+
+def _grades_block(subject: subject_index.SubjectEntry, rows: list) -> str:
+    graded = [row for row in rows if row.score is not None]
+    
+    if graded:
+        part = f"**{subject.name}** ({subject.code}):\n"
+        total_score = 0
+        total_weight = 0
         
-        if remaining_weight <= 0:
-             return "You have completed all assessments for this course."
-             
-        required_avg_on_remainder = (needed_points / remaining_weight) * 100
+        for row in graded:
+            part += f"- {row.name}: {row.score} ({logic.calculate_grade_letter(row.score)})\n"
+            total_score += row.score * (row.weight / 100)
+            total_weight += row.weight
         
-        if required_avg_on_remainder > 100:
-            return f"It's effectively impossible. You'd need {required_avg_on_remainder:.1f}% on remaining work."
-        elif required_avg_on_remainder < 0:
-            return "You've already secured that grade!"
+        part += f"Current Weighted Score: {total_score:.1f} (out of {total_weight} weight so far)\n"
+        return part
+    if rows:
+        # 3. No grades yet, so list the subject's assessments instead
+        assessment_names = ", ".join([f"{row.name} ({row.weight}%)" for row in rows])
+        return f"**{subject.name}**: No grades recorded yet. Assessments: {assessment_names}."
+    return f"**{subject.name}**: No grades or assessments found."
+
+# Pattern: "What's my rank in [Subject]?" / "Where do I rank in [Subject]?"
+@intent("rank", r"\brank(?:ed|ing)? (?:in|for) (?P<subject>.+)", cacheable=False)
+async def answer_rank(params: dict, db: AsyncSession, user_id: int) -> AsyncIterator[str]:
+    subject_name = params["subject"]
+    subjects = (await subject_index.get_index(db)).search(subject_name)
+    if not subjects:
+        yield f"I couldn't find any subject matching '{subject_name}'."
+        return
+
+    for subject in subjects:
+        index = await rankings.get_index(db, subject.id)
+        percentage = index.score_of(user_id)
+        if percentage is None:
+            yield f"**{subject.name}**: No grades recorded yet, so you aren't ranked."
+            continue
+        yield (
+            f"**{subject.name}** ({subject.code}): You are ranked {index.rank(percentage)} of {len(index)} "
+            f"with {percentage:.1f}%, at or above {index.percentile(percentage):.0f}% of the class."
+        )
+
+# Pattern: "How am I performing?"
+@intent("performance", r"performing|performance|summary")
+async def answer_performance(params: dict, db: AsyncSession, user_id: int) -> AsyncIterator[str]:
+    stats = await logic.get_cached_performance_summary(db, user_id)
+    if isinstance(stats, str):
+        yield stats
+        return
+    yield (f"Performance Summary:\n"
+            f"GPA: {stats['gpa']}\n"
+            f"Best Subject: {stats['best_subject']}\n"
+            f"Needs Improvement: {stats['worst_subject']}")
+
+# Pattern: "What do I need to score to get a [Grade]?"
+# We'll assume the user might say "What do I need for an A in Math?"
+@intent("prediction", r"need.*get a (?P<grade>[a-f]) in (?P<subject>.+)")
+async def answer_prediction(params: dict, db: AsyncSession, user_id: int) -> AsyncIterator[str]:
+    target_grade = params["grade"].upper()
+    subject_name = params["subject"]
+    
+    subject_ids = {subject.id for subject in (await subject_index.get_index(db)).search(subject_name)}
+    plan = [row for row in await logic.get_grade_plan(db, user_id) if row["subject_id"] in subject_ids]
+    if not plan:
+        yield f"No grades found for {subject_name} to base a prediction on."
+        return
+
+    for row in plan:
+        prefix = f"**{row['subject_name']}**: " if len(plan) > 1 else ""
+        if row["remaining_weight"] <= 0:
+            yield prefix + "You have completed all assessments for this course."
+            continue
+        # E/F have no threshold above zero, so they are always secured
+        required = row["required"].get(target_grade, -1)
+        if required > 100:
+            yield prefix + f"It's effectively impossible. You'd need {required:.1f}% on remaining work."
+        elif required < 0:
+            yield prefix + "You've already secured that grade!"
         else:
-            return f"You need to average {required_avg_on_remainder:.1f}% on the remaining {remaining_weight}% of the course."
+            yield prefix + f"You need to average {required:.1f}% on the remaining {row['remaining_weight']}% of the course."
+
+# Pattern: "What do I need?" across every subject
+@intent("plan", r"what do i need\b")
+async def answer_plan(params: dict, db: AsyncSession, user_id: int) -> AsyncIterator[str]:
+    plan = await logic.get_grade_plan(db, user_id)
+    if not plan:
+        yield "No grades recorded yet, so there's nothing to plan from."
+        return
+    yield "Average needed on remaining work (A / B / C / D):"
+    for row in plan:
+        if row["remaining_weight"] <= 0:
+            yield f"- {row['subject_name']}: all assessments completed"
+            continue
+        cells = []
+        for letter in logic.GRADE_THRESHOLDS:
+            required = row["required"][letter]
+            cells.append("secured" if required < 0 else "out of reach" if required > 100 else f"{required:.1f}%")
+        yield f"- {row['subject_name']} ({row['remaining_weight']}% remaining): " + " / ".join(cells)
+
+async def stream_answer(registered: Intent, params: dict, db: AsyncSession, user_id: int) -> AsyncIterator[str]:
+    """Run an intent's handler, yielding text pieces that concatenate to the full answer."""
+    first = True
+    async for block in registered.handler(params, db, user_id):
+        yield block if first else "\n" + block
+        first = False
+
+async def stream_query(query: str, db: AsyncSession, user_id: int) -> AsyncIterator[str]:
+    matched = match_intent(query.lower())
+    if matched is None:
+        yield FALLBACK_RESPONSE
+        return
+    registered, params = matched
+    async for piece in stream_answer(registered, params, db, user_id):
+        yield piece
 
-    return "I'm not sure I understand. Try asking about your grades in a specific subject or your overall performance."
+async def process_query(query: str, db: AsyncSession, user_id: int) -> str:
+    return "".join([piece async for piece in stream_query(query, db, user_id)])
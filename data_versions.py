@@ -0,0 +1,83 @@
+"""
+Per-student data versions for cache invalidation.
+
+Every write that can change a student's results bumps that student's version inside
+the write's own transaction: grade writes, and assessment weight/max_score changes or
+deletes for everyone graded on the assessment. A cached result keyed on
+(student_id, version) therefore goes stale exactly when it should, and because the
+counter lives in the database it works across worker processes.
+
+Listed resources ("subjects", "grades") have a version of their own in the same way,
+bumped by any write to them, which the list endpoints turn into ETags.
+"""
+from typing import Iterable
+from sqlalchemy import literal, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+
+Version = models.StudentDataVersion
+
+def _bump(rows_or_select):
+    # SQLite only parses ON CONFLICT after INSERT ... SELECT when the SELECT has a WHERE,
+    # which every caller's SELECT does.
+    stmt = sqlite_insert(Version)
+    if isinstance(rows_or_select, list):
+        stmt = stmt.values(rows_or_select)
+    else:
+        stmt = stmt.from_select(["student_id", "version"], rows_or_select)
+    return stmt.on_conflict_do_update(
+        index_elements=[Version.student_id],
+        set_={"version": Version.version + 1}
+    )
+
+async def bump_students(db: AsyncSession, student_ids: Iterable[int]):
+    """Bump the given students' versions. The caller commits."""
+    student_ids = sorted(set(student_ids))
+    if student_ids:
+        await db.execute(_bump([{"student_id": sid, "version": 1} for sid in student_ids]))
+
+async def bump_assessments(db: AsyncSession, assessment_ids: Iterable[int]):
+    """Bump everyone with a grade on these assessments, e.g. after a weight or max_score change."""
+    assessment_ids = sorted(set(assessment_ids))
+    if not assessment_ids:
+        return
+    graded = select(models.Grade.student_id, literal(1)).where(models.Grade.assessment_id.in_(assessment_ids)).distinct()
+    await db.execute(_bump(graded))
+
+async def bump_subject(db: AsyncSession, subject_id: int):
+    """Bump everyone with a grade on any of the subject's assessments."""
+    assessment_ids = select(models.Assessment.id).where(models.Assessment.subject_id == subject_id)
+    graded = select(models.Grade.student_id, literal(1)).where(models.Grade.assessment_id.in_(assessment_ids)).distinct()
+    await db.execute(_bump(graded))
+
+def bump_all_graded(conn):
+    """Sync helper for scripts that rewrite grades directly: bump every student with a grade."""
+    graded = select(models.Grade.student_id, literal(1)).where(models.Grade.student_id.is_not(None)).distinct()
+    conn.execute(_bump(graded))
+
+async def get_version(db: AsyncSession, student_id: int) -> int:
+    result = await db.execute(select(Version.version).where(Version.student_id == student_id))
+    return result.scalar() or 0
+
+Resource = models.ResourceVersion
+RESOURCES = ("subjects", "grades")
+
+def _bump_resources(names):
+    stmt = sqlite_insert(Resource).values([{"name": name, "version": 1} for name in sorted(set(names))])
+    return stmt.on_conflict_do_update(
+        index_elements=[Resource.name],
+        set_={"version": Resource.version + 1}
+    )
+
+async def bump_resources(db: AsyncSession, *names: str):
+    """Bump the named resources' versions. The caller commits."""
+    await db.execute(_bump_resources(names))
+
+def bump_all_resources(conn):
+    """Sync helper for scripts that rewrite data directly: bump every resource version."""
+    conn.execute(_bump_resources(RESOURCES))
+
+async def get_resource_version(db: AsyncSession, name: str) -> int:
+    result = await db.execute(select(Resource.version).where(Resource.name == name))
+    return result.scalar() or 0
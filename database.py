@@ -1,13 +1,104 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./student_grading.db"
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./student_grading.db")
+
+# Pragmas applied to every new SQLite connection. WAL lets readers run alongside the
+# single writer, and NORMAL sync is durable across application crashes in WAL mode.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Negative values are KiB rather than pages
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-64000")),
+    "temp_store": "MEMORY",
+}
+
+
+def default_pool_size() -> int:
+    """
+    Connections per worker process. Each uvicorn worker gets its own engine, so the
+    pool only needs to cover that worker's threadpool, not the whole deployment.
+    """
+    if os.getenv("DB_POOL_SIZE"):
+        return int(os.getenv("DB_POOL_SIZE"))
+    return min(32, (os.cpu_count() or 1) * 4)
+
+
+def _apply_sqlite_pragmas(dbapi_connection, read_only: bool):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            # Switching journal mode needs a write lock, leave it to the writer pool
+            if read_only and name == "journal_mode":
+                continue
+            cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+
+def make_engine(url: str = SQLALCHEMY_DATABASE_URL, read_only: bool = False, pool_size: int = None):
+    """
+    Build an engine for `url`. SQLite engines get the production pragmas on connect;
+    `read_only=True` additionally marks every connection query-only so it can never
+    take the writer lock.
+    """
+    is_sqlite = url.startswith("sqlite")
+    kwargs = {}
+    if is_sqlite:
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if not url.endswith(":memory:"):
+        kwargs["pool_size"] = pool_size or default_pool_size()
+        kwargs["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", "8"))
+    new_engine = create_engine(url, **kwargs)
+
+    if is_sqlite:
+        @event.listens_for(new_engine, "connect")
+        def _on_connect(dbapi_connection, connection_record):
+            _apply_sqlite_pragmas(dbapi_connection, read_only)
+
+    return new_engine
+
+
+def async_url(url: str) -> str:
+    """Map a sync database URL onto its async driver, e.g. sqlite:// -> sqlite+aiosqlite://."""
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+
+def make_async_engine(url: str = SQLALCHEMY_DATABASE_URL, read_only: bool = False, pool_size: int = None):
+    """Async counterpart of make_engine, used by the request path."""
+    is_sqlite = url.startswith("sqlite")
+    kwargs = {}
+    if not url.endswith(":memory:"):
+        kwargs["pool_size"] = pool_size or default_pool_size()
+        kwargs["max_overflow"] = int(os.getenv("DB_MAX_OVERFLOW", "8"))
+    new_engine = create_async_engine(async_url(url), **kwargs)
+
+    if is_sqlite:
+        @event.listens_for(new_engine.sync_engine, "connect")
+        def _on_connect(dbapi_connection, connection_record):
+            _apply_sqlite_pragmas(dbapi_connection, read_only)
+
+    return new_engine
+
+
+engine = make_engine()
+async_engine = make_async_engine()
+async_read_engine = make_async_engine(read_only=True)
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: attributes can't be lazily refreshed under asyncio, so objects
+# returned from a route must stay populated after the commit.
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -17,3 +108,23 @@ def get_db():
         yield db
     finally:
         db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def begin_read_snapshot(db: AsyncSession):
+    """
+    Make the rest of `db`'s reads see one snapshot of the database. The SQLite driver
+    issues no BEGIN before a SELECT, so each statement otherwise sees the latest commit;
+    an explicit deferred BEGIN holds the WAL snapshot from the first read until the
+    session ends.
+    """
+    conn = await db.connection()
+    if conn.dialect.name == "sqlite":
+        await conn.exec_driver_sql("BEGIN")
+
+async def get_async_read_db():
+    """Async session for GET routes, on the query-only pool."""
+    async with AsyncReadSessionLocal() as db:
+        yield db
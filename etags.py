@@ -0,0 +1,35 @@
+"""
+Conditional GET for list endpoints.
+
+ETags are derived from the database-held resource versions (see data_versions.py) plus
+whatever request parameters shape the body, so every worker computes the same tag and a
+matching If-None-Match can be answered with 304 before the list query runs.
+"""
+import hashlib
+from fastapi import Request, Response
+
+# Let clients keep the body but revalidate it on every use; responses are per-user.
+CACHE_CONTROL = "private, no-cache"
+
+def make_etag(resource: str, version: int, *params) -> str:
+    """Strong ETag for `resource` at `version`, varied by the request parameters."""
+    digest = hashlib.blake2b(repr(params).encode(), digest_size=8).hexdigest()
+    return f'"{resource}-{version}-{digest}"'
+
+def matches(request: Request, etag: str) -> bool:
+    """Whether the request's If-None-Match covers `etag` (weak comparison, per RFC 9110)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+def tag(response: Response, etag: str):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
@@ -0,0 +1,117 @@
+import asyncio
+import json
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+import schemas
+import auth
+import notifications
+from database import get_async_read_db
+
+# Seconds between keep-alive comments so proxies don't close idle streams
+KEEPALIVE_SECONDS = 15
+
+router = APIRouter(
+    prefix="/events",
+    tags=["events"]
+)
+
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+async def get_stream_user(
+    token: Optional[str] = None,
+    header_token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Like auth.get_current_user, but also accepts `?token=` because the browser
+    EventSource API can't send an Authorization header.
+    """
+    token = header_token or token
+    if not token:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return await auth.authenticate_token(token, db)
+
+def _event_filter(user: models.User):
+    """Lecturers see every event; students see subject changes and their own grades."""
+    if user.role == schemas.UserRole.lecturer:
+        return None
+    user_id = user.id
+    def accepts(event: dict) -> bool:
+        student_ids = event.get("student_ids")
+        return student_ids is None or user_id in student_ids
+    return accepts
+
+def _format_event(seq: int, event: dict, is_lecturer: bool) -> str:
+    if not is_lecturer:
+        # don't reveal which other students a bulk import touched
+        event = {k: v for k, v in event.items() if k != "student_ids"}
+    # the id lets EventSource resume from here with Last-Event-ID after a reconnect
+    return f"id: {seq}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+def _resync(**data) -> str:
+    return f"event: resync\ndata: {json.dumps(data)}\n\n"
+
+async def _event_stream(request: Request, sub: notifications.Subscription, is_lecturer: bool, last_event_id: Optional[int]):
+    reported_drops = 0
+    replayed_to = 0
+    try:
+        yield "retry: 5000\n\n"
+        if last_event_id is not None:
+            # Reconnecting client: send what it missed, or have it refetch if that's gone
+            missed = notifications.replay(last_event_id)
+            if missed is None:
+                yield _resync(dropped=None)
+            else:
+                for seq, event in missed:
+                    if sub.accepts is None or sub.accepts(event):
+                        yield _format_event(seq, event, is_lecturer)
+                    replayed_to = seq
+        while True:
+            try:
+                seq, event = await asyncio.wait_for(sub.get(), timeout=KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            if seq <= replayed_to:
+                # queued while the replay was being sent
+                continue
+            if sub.dropped != reported_drops:
+                # The client missed events while its queue was full; tell it to refetch
+                reported_drops = sub.dropped
+                yield _resync(dropped=reported_drops)
+            yield _format_event(seq, event, is_lecturer)
+    finally:
+        notifications.unsubscribe(sub)
+
+@router.get("/")
+async def stream_events(request: Request, last_event_id: Optional[int] = None, current_user: models.User = Depends(get_stream_user)):
+    """
+    Server-sent events for grade and subject changes, so dashboards can refresh
+    on change instead of polling.
+
+    Each event carries a sequence number as its id. Browsers send it back as the
+    Last-Event-ID header when they reconnect (or pass `?last_event_id=`), and the
+    events missed in between are replayed; a `resync` event means they are gone
+    and the client should refetch.
+    """
+    header = request.headers.get("last-event-id", "")
+    if header.isdigit():
+        last_event_id = int(header)
+    sub = notifications.subscribe(_event_filter(current_user))
+    is_lecturer = current_user.role == schemas.UserRole.lecturer
+    return StreamingResponse(
+        _event_stream(request, sub, is_lecturer, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
@@ -1,11 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, joinedload
-from typing import List
+import codecs
+import csv
+import json
+import re
+from collections import deque
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from typing import List, Optional, Tuple
 
 import models
 import schemas
 import auth
-from database import get_db
+import aggregates
+import data_versions
+import etags
+import logic
+import notifications
+import rankings
+from database import AsyncReadSessionLocal, get_async_db, get_async_read_db
+
+# Rows fetched per round trip when streaming the whole table as NDJSON
+STREAM_BATCH_SIZE = 1000
 
 router = APIRouter(
     prefix="/grades",
@@ -21,46 +40,377 @@ def require_lecturer(current_user: models.User = Depends(auth.get_current_user))
         )
     return current_user
 
+def _upsert_grades():
+    """
+    INSERT ... ON CONFLICT (student_id, assessment_id) DO UPDATE, so re-entering a score
+    replaces it instead of adding a duplicate row. Works for single rows and executemany.
+    """
+    stmt = sqlite_insert(models.Grade)
+    return stmt.on_conflict_do_update(
+        index_elements=[models.Grade.student_id, models.Grade.assessment_id],
+        set_={"score": stmt.excluded.score}
+    )
+
 @router.post("/", response_model=schemas.Grade, status_code=status.HTTP_201_CREATED)
-def create_grade(grade: schemas.GradeCreate, db: Session = Depends(get_db), current_user: models.User = Depends(require_lecturer)):
+async def create_grade(grade: schemas.GradeCreate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(require_lecturer)):
     """
     Allows a lecturer to add a new grade for a student.
+    If the student already has a grade for this assessment, its score is replaced.
     """
     # Find the student by their student number
-    student = db.query(models.User).filter(models.User.student_number == grade.student_number).first()
-    if not student:
+    result = await db.execute(select(models.User.id).where(models.User.student_number == grade.student_number))
+    student_id = result.scalar()
+    if student_id is None:
         raise HTTPException(status_code=404, detail=f"Student with number {grade.student_number} not found")
 
     # Check if the assessment exists
-    assessment = db.query(models.Assessment).filter(models.Assessment.id == grade.assessment_id).first()
+    assessment = await db.get(models.Assessment, grade.assessment_id)
     if not assessment:
         raise HTTPException(status_code=404, detail=f"Assessment with id {grade.assessment_id} not found")
 
-    db_grade = models.Grade(
-        student_id=student.id,
-        assessment_id=grade.assessment_id,
-        score=grade.score
+    result = await db.execute(
+        _upsert_grades()
+        .values(student_id=student_id, assessment_id=grade.assessment_id, score=grade.score)
+        .returning(models.Grade.id)
+    )
+    grade_id = result.scalar_one()
+    await aggregates.refresh(db, [student_id], [assessment.subject_id])
+    await data_versions.bump_students(db, [student_id])
+    await data_versions.bump_resources(db, "grades")
+    await db.commit()
+    await rankings.refresh_students(db, [assessment.subject_id], [student_id])
+    await notifications.publish({
+        "type": "grade.saved",
+        "grade_id": grade_id,
+        "assessment_id": grade.assessment_id,
+        "subject_id": assessment.subject_id,
+        "student_ids": [student_id],
+    })
+    return schemas.Grade(id=grade_id, **grade.model_dump())
+
+# Line endings as io.StringIO(newline="") splits them for the csv module
+_LINE_END = re.compile(r"\r\n|\r|\n")
+
+def _split_lines(text: str, final: bool) -> Tuple[List[str], str]:
+    """Split `text` into complete lines, endings kept, and the unterminated rest."""
+    lines, start = [], 0
+    for m in _LINE_END.finditer(text):
+        if m.group() == "\r" and m.end() == len(text) and not final:
+            # may be the first half of a CRLF split across chunks
+            break
+        lines.append(text[start:m.end()])
+        start = m.end()
+    return lines, text[start:]
+
+async def _iter_lines(request: Request, keepends: bool = False):
+    """
+    Yield decoded text lines from the request body as chunks arrive, without their line
+    ending (LF, CRLF or a bare CR) unless `keepends` is set.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in request.stream():
+        lines, pending = _split_lines(pending + decoder.decode(chunk), final=False)
+        for line in lines:
+            yield line if keepends else line.rstrip("\r\n")
+    lines, pending = _split_lines(pending + decoder.decode(b"", final=True), final=True)
+    for line in lines:
+        yield line if keepends else line.rstrip("\r\n")
+    if keepends and pending:
+        yield pending
+    elif pending.strip():
+        yield pending
+
+class _LineBuffer:
+    """Line source for a csv.reader that is topped up between reads as the body arrives."""
+    def __init__(self):
+        self.lines = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+def _quote_state(line: str, in_quotes: bool) -> bool:
+    """Whether a CSV record is still inside a quoted field after `line`, per csv's default dialect."""
+    field_start = not in_quotes
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if in_quotes:
+            if c == '"':
+                if line[i + 1:i + 2] == '"':
+                    i += 1
+                else:
+                    in_quotes = False
+        elif c == '"' and field_start:
+            in_quotes = True
+        field_start = c == ","
+        i += 1
+    return in_quotes
+
+async def _iter_csv_records(request: Request):
+    """
+    Yield the body's CSV records (lists of fields, or a csv.Error) as they arrive. Lines
+    are held back until the record is complete and then fed to one csv.reader, so quoted
+    fields may span lines and LF, CRLF and bare CR endings read as csv.reader reads them.
+    """
+    buffer = _LineBuffer()
+    reader = csv.reader(buffer)
+    in_quotes = False
+    record = []
+    async for line in _iter_lines(request, keepends=True):
+        record.append(line)
+        in_quotes = _quote_state(line, in_quotes)
+        if not in_quotes:
+            buffer.lines.extend(record)
+            record = []
+            for values in _read_buffered(reader, buffer):
+                yield values
+    # an unterminated quoted field runs to the end of the body
+    buffer.lines.extend(record)
+    for values in _read_buffered(reader, buffer):
+        yield values
+
+def _read_buffered(reader, buffer: _LineBuffer):
+    while buffer.lines:
+        try:
+            yield next(reader)
+        except csv.Error as e:
+            yield e
+
+async def _iter_rows(request: Request):
+    """
+    Yield (row_number, dict) pairs from a CSV (with header) or NDJSON body.
+    Unparseable rows are yielded as (row_number, error message) so they end up in the report.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in ("text/csv", "application/csv"):
+        header = None
+        row_number = 0
+        async for values in _iter_csv_records(request):
+            if isinstance(values, csv.Error):
+                row_number += 1
+                yield row_number, f"Invalid CSV: {values}"
+                continue
+            if not values or (len(values) == 1 and not values[0].strip()):
+                continue
+            if header is None:
+                header = [h.strip() for h in values]
+                continue
+            row_number += 1
+            if len(values) != len(header):
+                yield row_number, f"Expected {len(header)} columns, got {len(values)}"
+                continue
+            yield row_number, dict(zip(header, (v.strip() for v in values)))
+    elif content_type in ("application/x-ndjson", "application/jsonl", "application/json-lines"):
+        row_number = 0
+        async for line in _iter_lines(request):
+            if not line.strip():
+                continue
+            row_number += 1
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, f"Invalid JSON: {e.msg}"
+                continue
+            if not isinstance(row, dict):
+                yield row_number, "Each line must be a JSON object"
+                continue
+            yield row_number, row
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Send grades as text/csv or application/x-ndjson"
+        )
+
+@router.post("/bulk", response_model=schemas.BulkGradeResult)
+async def bulk_create_grades(request: Request, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(require_lecturer)):
+    """
+    Allows a lecturer to import many grades at once from a CSV or NDJSON upload
+    with `student_number`, `assessment_id` and `score` columns.
+
+    Students and assessments are resolved with one IN query each and all valid rows are
+    upserted in a single transaction, so re-importing a gradebook updates scores in place.
+    Bad rows are reported back instead of aborting the import.
+    """
+    errors = []
+    parsed = []
+    received = 0
+    async for row_number, row in _iter_rows(request):
+        received += 1
+        if isinstance(row, str):
+            errors.append(schemas.BulkGradeError(row=row_number, error=row))
+            continue
+        try:
+            parsed.append((row_number, schemas.GradeCreate(**row)))
+        except ValidationError as e:
+            first = e.errors()[0]
+            field = ".".join(str(part) for part in first["loc"])
+            errors.append(schemas.BulkGradeError(row=row_number, error=f"{field}: {first['msg']}"))
+
+    student_numbers = {grade.student_number for _, grade in parsed}
+    assessment_ids = {grade.assessment_id for _, grade in parsed}
+    students = {}
+    if student_numbers:
+        result = await db.execute(
+            select(models.User.student_number, models.User.id).where(models.User.student_number.in_(student_numbers))
+        )
+        students = dict(result.all())
+    assessment_subjects = {}
+    if assessment_ids:
+        result = await db.execute(
+            select(models.Assessment.id, models.Assessment.subject_id).where(models.Assessment.id.in_(assessment_ids))
+        )
+        assessment_subjects = dict(result.all())
+
+    values = []
+    for row_number, grade in parsed:
+        student_id = students.get(grade.student_number)
+        if student_id is None:
+            errors.append(schemas.BulkGradeError(row=row_number, error=f"Student with number {grade.student_number} not found"))
+        elif grade.assessment_id not in assessment_subjects:
+            errors.append(schemas.BulkGradeError(row=row_number, error=f"Assessment with id {grade.assessment_id} not found"))
+        else:
+            values.append({"student_id": student_id, "assessment_id": grade.assessment_id, "score": grade.score})
+
+    if values:
+        await db.execute(_upsert_grades(), values)
+        await aggregates.refresh(
+            db,
+            {v["student_id"] for v in values},
+            {assessment_subjects[v["assessment_id"]] for v in values}
+        )
+        await data_versions.bump_students(db, {v["student_id"] for v in values})
+        await data_versions.bump_resources(db, "grades")
+        await db.commit()
+        await rankings.refresh_students(
+            db,
+            {assessment_subjects[v["assessment_id"]] for v in values},
+            {v["student_id"] for v in values}
+        )
+        await notifications.publish({
+            "type": "grades.imported",
+            "assessment_ids": sorted({v["assessment_id"] for v in values}),
+            "student_ids": sorted({v["student_id"] for v in values}),
+        })
+
+    errors.sort(key=lambda e: e.row)
+    return schemas.BulkGradeResult(received=received, inserted=len(values), errors=errors)
+
+def _grade_rows_query(after_id: Optional[int], subject_id: Optional[int], assessment_id: Optional[int], student_number: Optional[str]):
+    """Keyset query over grades: plain columns ordered by Grade.id, starting after `after_id`."""
+    query = (
+        select(models.Grade.id, models.Grade.score, models.Grade.assessment_id, models.User.student_number)
+        .join(models.User, models.Grade.student_id == models.User.id)
+        .order_by(models.Grade.id)
     )
-    db.add(db_grade)
-    db.commit()
-    db.refresh(db_grade)
-    return db_grade
+    if after_id is not None:
+        query = query.where(models.Grade.id > after_id)
+    if subject_id is not None:
+        query = query.join(models.Assessment, models.Grade.assessment_id == models.Assessment.id).where(models.Assessment.subject_id == subject_id)
+    if assessment_id is not None:
+        query = query.where(models.Grade.assessment_id == assessment_id)
+    if student_number is not None:
+        query = query.where(models.User.student_number == student_number)
+    return query
+
+async def _stream_grades_ndjson(after_id, subject_id, assessment_id, student_number):
+    # The request-scoped session may be closed before the body is sent, so the stream owns its own.
+    async with AsyncReadSessionLocal() as db:
+        while True:
+            result = await db.execute(
+                _grade_rows_query(after_id, subject_id, assessment_id, student_number).limit(STREAM_BATCH_SIZE)
+            )
+            rows = result.mappings().all()
+            if not rows:
+                return
+            yield "".join(json.dumps(dict(row)) + "\n" for row in rows)
+            if len(rows) < STREAM_BATCH_SIZE:
+                return
+            after_id = rows[-1]["id"]
 
 @router.get("/", response_model=List[schemas.Grade])
-def get_all_grades(db: Session = Depends(get_db), current_user: models.User = Depends(require_lecturer)):
+async def get_all_grades(
+    request: Request,
+    response: Response,
+    after_id: Optional[int] = Query(None, description="Cursor: return grades with an id greater than this"),
+    limit: int = Query(100, ge=1, le=1000),
+    subject_id: Optional[int] = None,
+    assessment_id: Optional[int] = None,
+    student_number: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: models.User = Depends(require_lecturer)
+):
+    """
+    Allows a lecturer to retrieve grades, one page of `limit` (default 100) at a time.
+
+    Pages are keyed on the grade id: pass the `X-Next-Cursor` response header back as
+    `after_id` to get the next page; the header is absent on the last page.
+    Send `Accept: application/x-ndjson` to stream every matching grade after `after_id`
+    instead (`limit` does not apply).
+    Responses carry an ETag; send it back in If-None-Match to get a 304 while no grade has changed.
+    """
+    ndjson = "application/x-ndjson" in request.headers.get("accept", "")
+    etag = etags.make_etag(
+        "grades", await data_versions.get_resource_version(db, "grades"),
+        ndjson, after_id, None if ndjson else limit, subject_id, assessment_id, student_number
+    )
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+
+    if ndjson:
+        streaming = StreamingResponse(
+            _stream_grades_ndjson(after_id, subject_id, assessment_id, student_number),
+            media_type="application/x-ndjson"
+        )
+        etags.tag(streaming, etag)
+        return streaming
+
+    # Fetch one extra row to learn whether another page exists
+    result = await db.execute(_grade_rows_query(after_id, subject_id, assessment_id, student_number).limit(limit + 1))
+    rows = result.mappings().all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    etags.tag(response, etag)
+    return rows
+
+@router.get("/cohort/gpa", response_model=List[schemas.CohortGpaResponse])
+async def get_cohort_gpa(subject_id: Optional[int] = None, db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(require_lecturer)):
+    """
+    Allows a lecturer to see the GPA breakdown of every student with recorded grades,
+    optionally limited to one subject. Computed for the whole cohort in one query.
+    """
+    return await logic.get_cohort_gpa(db, subject_id)
+
+@router.get("/me/gpa", response_model=schemas.GpaResponse)
+async def get_my_gpa(db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(auth.get_current_user)):
+    """
+    The current student's GPA breakdown. Served from the versioned result cache
+    while none of their grades or assessments have changed.
+    """
+    return await logic.get_cached_gpa_breakdown(db, current_user.id)
+
+@router.get("/me/plan", response_model=List[schemas.GradePlanRow])
+async def get_my_grade_plan(db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(auth.get_current_user)):
     """
-    Allows a lecturer to retrieve all grades from the system.
+    What the current student needs on their remaining assessments to reach each
+    letter grade, for every subject they have grades in.
     """
-    grades = db.query(models.Grade).options(joinedload(models.Grade.student)).all()
-    return grades
+    return await logic.get_grade_plan(db, current_user.id)
 
 @router.delete("/{grade_id}", response_model=schemas.Grade)
-def delete_grade(grade_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(require_lecturer)):
+async def delete_grade(grade_id: int, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(require_lecturer)):
     """
     Allows a lecturer to delete a specific grade by its ID.
     This is the backend functionality for the 'remove grade' button.
     """
-    grade_to_delete = db.query(models.Grade).filter(models.Grade.id == grade_id).first()
+    # Load the student up front, the response needs its student_number after the delete
+    grade_to_delete = await db.get(models.Grade, grade_id, options=[joinedload(models.Grade.student)])
 
     if not grade_to_delete:
         raise HTTPException(
@@ -68,9 +418,23 @@ def delete_grade(grade_id: int, db: Session = Depends(get_db), current_user: mod
             detail=f"Grade with id {grade_id} not found."
         )
 
-    db.delete(grade_to_delete)
-    db.commit()
+    assessment = await db.get(models.Assessment, grade_to_delete.assessment_id)
+    await db.delete(grade_to_delete)
+    # autoflush is off; the DELETE must reach the database before aggregates are recomputed
+    await db.flush()
+    if assessment is not None:
+        await aggregates.refresh(db, [grade_to_delete.student_id], [assessment.subject_id])
+    await data_versions.bump_students(db, [grade_to_delete.student_id])
+    await data_versions.bump_resources(db, "grades")
+    await db.commit()
+    if assessment is not None:
+        await rankings.refresh_students(db, [assessment.subject_id], [grade_to_delete.student_id])
+    await notifications.publish({
+        "type": "grade.deleted",
+        "grade_id": grade_id,
+        "assessment_id": grade_to_delete.assessment_id,
+        "student_ids": [grade_to_delete.student_id],
+    })
 
-    # The grade object is expired after commit, so we can't return it directly.
-    # We can construct a response from the data we had before deleting.
+    # Sessions don't expire on commit, so the deleted object still carries its data.
     return grade_to_delete
\ No newline at end of file
@@ -1,5 +1,18 @@
-from sqlalchemy.orm import Session
+import os
+from typing import Optional
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 import models
+import data_versions
+from cache import LRUCache
+
+# Derived per-student results keyed by (kind, student_id, data version). A new version makes
+# old entries unreachable, so they are never served stale and simply age out of the LRU.
+result_cache = LRUCache(
+    maxsize=int(os.getenv("RESULT_CACHE_SIZE", "10000")),
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+)
 
 def calculate_grade_letter(score: float) -> str:
     if score >= 90: return "A"
@@ -140,19 +153,163 @@ def calculate_gpa_breakdown(grades: list[models.Grade]) -> dict:
         'graded_assessments': graded_count
     }
 
-def get_student_performance_summary(db: Session, student_id: int):
-    grades = db.query(models.Grade).filter(models.Grade.student_id == student_id).all()
-    if not grades:
+def calculate_gpa_breakdowns(student_ids, scores, max_scores, weights) -> dict:
+    """
+    Vectorised `calculate_gpa_breakdown` for many students at once.
+
+    Takes one entry per grade as parallel columns (None/NaN for a missing max_score or
+    weight, e.g. an orphaned grade) and returns {student_id: breakdown dict}. Rows must be
+    ordered by grade id within each student so the sums accumulate in the same order as
+    the per-student function, which keeps the results bit-for-bit identical.
+    """
+    if len(student_ids) == 0:
+        return {}
+    student_ids = np.asarray(student_ids, dtype=np.int64)
+    scores = np.asarray(scores, dtype=float)
+    max_scores = np.asarray(max_scores, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+
+    ids, index = np.unique(student_ids, return_inverse=True)
+    n = len(ids)
+
+    # Same per-grade rules as calculate_gpa_breakdown; NaN compares False so missing values fall through
+    has_max = max_scores > 0
+    pct = np.where(has_max, scores / np.where(has_max, max_scores, 1.0) * 100, scores)
+    is_weighted = weights > 0
+    weight = np.where(is_weighted, weights, 0.0)
+
+    # bincount accumulates sequentially in input order, matching the Python loop
+    weighted_sum = np.bincount(index, weights=np.where(is_weighted, pct * weight, 0.0), minlength=n)
+    weight_sum = np.bincount(index, weights=weight, minlength=n)
+    unweighted_sum = np.bincount(index, weights=np.where(is_weighted, 0.0, pct), minlength=n)
+    unweighted_count = np.bincount(index, weights=(~is_weighted).astype(float), minlength=n)
+    graded_count = np.bincount(index, minlength=n)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weighted_avg = weighted_sum / weight_sum
+        unweighted_avg = unweighted_sum / unweighted_count
+    final = np.where(
+        weight_sum > 0,
+        np.where(unweighted_count > 0, (weighted_avg + unweighted_avg) / 2, weighted_avg),
+        np.where(unweighted_count > 0, unweighted_avg, 0.0)
+    )
+    gpa5 = (final / 100.0) * 5.0
+
+    # Python's round() rather than np.round so ties resolve exactly as in calculate_gpa_breakdown
+    return {
+        int(student_id): {
+            'gpa': round(float(gpa5[i]), 2),
+            'percentage': round(float(final[i]), 2),
+            'recorded_weight': round(float(weight_sum[i]), 2),
+            'graded_assessments': int(graded_count[i])
+        }
+        for i, student_id in enumerate(ids)
+    }
+
+async def get_cohort_gpa(db: AsyncSession, subject_id: Optional[int] = None) -> list[dict]:
+    """
+    GPA breakdown for every student with grades, from a single columnar query.
+    With `subject_id`, only grades for that subject's assessments count. Grades whose
+    assessment no longer exists are left out, as in the per-subject aggregates.
+    """
+    query = (
+        select(models.Grade.student_id, models.User.student_number, models.Grade.score,
+               models.Assessment.max_score, models.Assessment.weight)
+        .join(models.User, models.Grade.student_id == models.User.id)
+        .join(models.Assessment, models.Grade.assessment_id == models.Assessment.id)
+        .order_by(models.Grade.student_id, models.Grade.id)
+    )
+    if subject_id is not None:
+        query = query.where(models.Assessment.subject_id == subject_id)
+    rows = (await db.execute(query)).all()
+    if not rows:
+        return []
+
+    student_ids, student_numbers, scores, max_scores, weights = zip(*rows)
+    breakdowns = calculate_gpa_breakdowns(
+        student_ids,
+        scores,
+        [np.nan if m is None else m for m in max_scores],
+        [np.nan if w is None else w for w in weights],
+    )
+    numbers = dict(zip(student_ids, student_numbers))
+    return [
+        {'student_id': student_id, 'student_number': numbers[student_id], **breakdown}
+        for student_id, breakdown in breakdowns.items()
+    ]
+
+def blend_breakdown(weighted_sum: float, weight_sum: float, unweighted_sum: float,
+                    unweighted_count: int, graded_count: int) -> dict:
+    """
+    Finish `calculate_gpa_breakdown` from pre-aggregated sums (e.g. SQL SUMs per subject):
+    the weighted average, blended 50/50 with the mean of unweighted grades when both exist.
+    """
+    if weight_sum > 0:
+        final_percentage = weighted_sum / weight_sum
+        if unweighted_count > 0:
+            final_percentage = (final_percentage + unweighted_sum / unweighted_count) / 2
+    elif unweighted_count > 0:
+        final_percentage = unweighted_sum / unweighted_count
+    else:
+        final_percentage = 0.0
+
+    gpa5 = (final_percentage / 100.0) * 5.0
+    return {
+        'gpa': round(gpa5, 2),
+        'percentage': round(final_percentage, 2),
+        'recorded_weight': round(weight_sum, 2),
+        'graded_assessments': graded_count
+    }
+
+def _blend_aggregates(rows) -> dict:
+    return blend_breakdown(
+        sum(r.weighted_sum for r in rows),
+        sum(r.weight_sum for r in rows),
+        sum(r.unweighted_sum for r in rows),
+        sum(r.unweighted_count for r in rows),
+        sum(r.graded_count for r in rows),
+    )
+
+async def get_student_gpa_breakdown(db: AsyncSession, student_id: int) -> dict:
+    """`calculate_gpa_breakdown` for one student, from their per-subject aggregate rows."""
+    result = await db.execute(
+        select(models.StudentSubjectAggregate).where(models.StudentSubjectAggregate.student_id == student_id)
+    )
+    return _blend_aggregates(result.scalars().all())
+
+async def get_student_performance_summary(db: AsyncSession, student_id: int):
+    """
+    GPA, best/worst subject and grade count for one student, read from the
+    precomputed per-subject aggregates (one row per subject), with window ranking
+    over each subject's highest/lowest score picking the best and worst subject.
+    Ties go to the lowest subject id for best and the highest for worst. Grades whose
+    assessment no longer exists are not aggregated, so they count towards neither.
+    """
+    Aggregate = models.StudentSubjectAggregate
+    query = (
+        select(
+            Aggregate.weighted_sum,
+            Aggregate.weight_sum,
+            Aggregate.unweighted_sum,
+            Aggregate.unweighted_count,
+            Aggregate.graded_count,
+            models.Subject.name,
+            func.row_number().over(order_by=(Aggregate.best_score.desc(), Aggregate.subject_id)).label("best_rank"),
+            func.row_number().over(order_by=(Aggregate.worst_score.asc(), Aggregate.subject_id.desc())).label("worst_rank"),
+        )
+        .join(models.Subject, Aggregate.subject_id == models.Subject.id)
+        .where(Aggregate.student_id == student_id)
+    )
+    rows = (await db.execute(query)).all()
+    if not rows:
         return "No grades recorded yet."
-    
-    gpa = calculate_gpa(grades)
-    total_subjects = len(grades)
-    
-    # Identify strengths and weaknesses
-    sorted_grades = sorted(grades, key=lambda g: g.score, reverse=True)
-    best_subject = sorted_grades[0].assessment.subject.name if sorted_grades else "N/A"
-    worst_subject = sorted_grades[-1].assessment.subject.name if sorted_grades else "N/A"
-    
+
+    breakdown = _blend_aggregates(rows)
+    gpa = breakdown['gpa']
+    total_subjects = breakdown['graded_assessments']
+    best_subject = next(r.name for r in rows if r.best_rank == 1)
+    worst_subject = next(r.name for r in rows if r.worst_rank == 1)
+
     return {
         "gpa": gpa,
         "total_subjects": total_subjects,
@@ -161,25 +318,75 @@ def get_student_performance_summary(db: Session, student_id: int):
         "summary": f"Current GPA is {gpa}. Best performance in {best_subject}."
     }
 
-def predict_grade_needed(current_score: float, current_weight: float, target_grade_letter: str) -> str:
-    # Simplified prediction: "What do I need on the final (remaining weight) to get X?"
-    # This requires more complex logic about total course structure, 
-    # assuming we know the total weight is 100.
-    
-    target_score = 0
-    if target_grade_letter == "A": target_score = 90
-    elif target_grade_letter == "B": target_score = 80
-    elif target_grade_letter == "C": target_score = 70
-    elif target_grade_letter == "D": target_score = 60
-    
-    remaining_weight = 100 - current_weight
+async def _cached_result(kind: str, db: AsyncSession, student_id: int, compute):
+    version = await data_versions.get_version(db, student_id)
+    key = (kind, student_id, version)
+    cached = result_cache.get(key)
+    if cached is None:
+        cached = await compute(db, student_id)
+        result_cache.set(key, cached)
+    return cached
+
+async def get_cached_gpa_breakdown(db: AsyncSession, student_id: int) -> dict:
+    """`get_student_gpa_breakdown`, served from `result_cache` while the student's data version is unchanged."""
+    return await _cached_result("gpa", db, student_id, get_student_gpa_breakdown)
+
+async def get_cached_performance_summary(db: AsyncSession, student_id: int):
+    """`get_student_performance_summary`, served from `result_cache` while the student's data version is unchanged."""
+    return await _cached_result("summary", db, student_id, get_student_performance_summary)
+
+# Minimum course percentage for each letter, as used by calculate_grade_letter
+GRADE_THRESHOLDS = {"A": 90, "B": 80, "C": 70, "D": 60}
+
+def required_average(current_points: float, completed_weight: float, target_score: float) -> Optional[float]:
+    """
+    Average percentage needed on the remaining (100 - completed_weight)% of a course to
+    finish on `target_score`, given `current_points` already earned out of 100.
+    None when no weight remains. Above 100 is unreachable; below 0 is already secured.
+    """
+    remaining_weight = 100 - completed_weight
     if remaining_weight <= 0:
+        return None
+    return (target_score - current_points) / remaining_weight * 100
+
+async def get_grade_plan(db: AsyncSession, student_id: int) -> list[dict]:
+    """
+    For every subject the student has grades in, the average needed on the remaining
+    weight to reach each letter A-D. One query over the per-subject aggregates.
+    """
+    Aggregate = models.StudentSubjectAggregate
+    result = await db.execute(
+        select(models.Subject.id, models.Subject.name, models.Subject.code, Aggregate.weighted_sum, Aggregate.weight_sum)
+        .join(Aggregate, Aggregate.subject_id == models.Subject.id)
+        .where(Aggregate.student_id == student_id)
+        .order_by(models.Subject.name)
+    )
+    plan = []
+    for subject_id, name, code, weighted_sum, weight_sum in result.all():
+        # weighted_sum is sum(percentage * weight), so this is the points earned out of 100
+        current_points = weighted_sum / 100
+        plan.append({
+            "subject_id": subject_id,
+            "subject_name": name,
+            "subject_code": code,
+            "current_points": round(current_points, 2),
+            "completed_weight": round(weight_sum, 2),
+            "remaining_weight": round(max(100 - weight_sum, 0), 2),
+            "required": {
+                letter: (None if needed is None else round(needed, 1))
+                for letter, target in GRADE_THRESHOLDS.items()
+                for needed in [required_average(current_points, weight_sum, target)]
+            },
+        })
+    return plan
+
+def predict_grade_needed(current_score: float, current_weight: float, target_grade_letter: str) -> str:
+    # "What do I need on the remaining weight to get X?", for a course whose weights total 100
+    # and where `current_score` is the average percentage over the completed `current_weight`.
+    target_score = GRADE_THRESHOLDS.get(target_grade_letter, 0)
+    needed_score = required_average(current_score * current_weight / 100, current_weight, target_score)
+    if needed_score is None:
         return "Course is already completed or weights are incorrect."
-        
-    # Formula: (CurrentScore * CurrentWeight + NeededScore * RemainingWeight) / 100 = TargetScore
-    # NeededScore = (TargetScore * 100 - CurrentScore * CurrentWeight) / RemainingWeight
-    
-    needed_score = (target_score * 100 - current_score * current_weight) / remaining_weight
     
     if needed_score > 100:
         return "It is mathematically impossible to achieve this grade."
@@ -1,12 +1,30 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from database import engine
-import models
+from fastapi.responses import JSONResponse
+from database import AsyncReadSessionLocal
+import chatbot
+import subject_index
+import notifications
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth, grades, chat, subjects
+from routers import auth, grades, chat, subjects, events, assessments, cache_stats
 
-models.Base.metadata.create_all(bind=engine)
+# The schema is not touched here: run `python migrations.py` (serve.py does it once
+# before starting workers) so importing the app in each worker has no side effects.
 
-app = FastAPI(title="Student Performance Chatbot API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the hot in-memory structures before reporting ready
+    chatbot.match_intent("how am i performing?")
+    async with AsyncReadSessionLocal() as db:
+        await subject_index.load(db)
+    await notifications.start()
+    app.state.ready = True
+    yield
+    app.state.ready = False
+    await notifications.stop()
+
+app = FastAPI(title="Student Performance Chatbot API", lifespan=lifespan)
+app.state.ready = False
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,18 +32,34 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let the frontend read the grade list's page cursor and the list ETags
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 app.include_router(auth.router)
 app.include_router(grades.router)
 app.include_router(chat.router)
 app.include_router(subjects.router)
+app.include_router(events.router)
+app.include_router(assessments.router)
+app.include_router(cache_stats.router)
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Student Performance Chatbot API"}
+
+@app.get("/ready")
+def read_ready():
+    """Readiness probe: 200 once this worker has finished warming up, 503 until then."""
+    if not app.state.ready:
+        return JSONResponse(status_code=503, content={"status": "starting"})
+    return {"status": "ready"}
+
 if __name__ == "__main__":
+    # Development server with auto-reload; use `python serve.py` in production
     import uvicorn, threading, time, webbrowser
+    import migrations
+    migrations.run_migrations()
     def open_browser():
         # Wait a short moment for the server to start
         time.sleep(1)
@@ -0,0 +1,57 @@
+"""
+Idempotent schema migrations for databases created by older versions of the app.
+`create_all` only creates missing tables, so changes to existing tables live here.
+Run with `python migrations.py`.
+"""
+from sqlalchemy import text
+from database import engine
+import aggregates
+import models
+
+def dedupe_grades(conn) -> int:
+    """
+    Keep only the most recent grade (highest id) for each (student, assessment) pair.
+    Returns the number of duplicate rows removed.
+    """
+    result = conn.execute(text(
+        "DELETE FROM grades WHERE id NOT IN ("
+        " SELECT MAX(id) FROM grades GROUP BY student_id, assessment_id"
+        ")"
+    ))
+    return result.rowcount
+
+def add_grade_uniqueness(conn):
+    removed = dedupe_grades(conn)
+    if removed:
+        print(f"Removed {removed} duplicate grades")
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_grades_student_assessment "
+        "ON grades (student_id, assessment_id)"
+    ))
+
+def build_grade_aggregates(conn):
+    """Populate student_subject_aggregates the first time it exists alongside existing grades."""
+    has_aggregates = conn.execute(text("SELECT 1 FROM student_subject_aggregates LIMIT 1")).first()
+    has_grades = conn.execute(text("SELECT 1 FROM grades LIMIT 1")).first()
+    if has_grades and not has_aggregates:
+        aggregates.rebuild(conn)
+
+def add_grade_assessment_index(conn):
+    # Lets subject/assessment deletes find their grades without scanning the table
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_grades_assessment_id ON grades (assessment_id)"))
+
+MIGRATIONS = [
+    add_grade_uniqueness,
+    build_grade_aggregates,
+    add_grade_assessment_index,
+]
+
+def run_migrations(bind=engine):
+    models.Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        for migration in MIGRATIONS:
+            migration(conn)
+
+if __name__ == "__main__":
+    run_migrations()
+    print("Migrations applied.")
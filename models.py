@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Enum, Index, Text
 from sqlalchemy.orm import relationship
 from database import Base
 import enum
@@ -44,10 +44,14 @@ class Assessment(Base):
 
 class Grade(Base):
     __tablename__ = "grades"
+    # One score per student per assessment; re-entering a grade updates it in place
+    __table_args__ = (
+        Index("ix_grades_student_assessment", "student_id", "assessment_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     student_id = Column(Integer, ForeignKey("users.id"))
-    assessment_id = Column(Integer, ForeignKey("assessments.id"))
+    assessment_id = Column(Integer, ForeignKey("assessments.id"), index=True)
     score = Column(Float)
 
     student = relationship("User", back_populates="grades")
@@ -63,3 +67,53 @@ class Grade(Base):
             return self.student.student_number if self.student else None
         except Exception:
             return None
+
+class StudentSubjectAggregate(Base):
+    """
+    Pre-aggregated grade sums per (student, subject), maintained by `aggregates.refresh`
+    whenever grades, assessments or subjects change. GPA reads use these O(subjects)
+    rows instead of scanning every grade. Grades whose assessment no longer exists
+    are not counted.
+    """
+    __tablename__ = "student_subject_aggregates"
+
+    student_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    subject_id = Column(Integer, ForeignKey("subjects.id"), primary_key=True, index=True)
+    weighted_sum = Column(Float, default=0.0)     # sum of percentage * weight over weighted grades
+    weight_sum = Column(Float, default=0.0)       # sum of weights over weighted grades
+    unweighted_sum = Column(Float, default=0.0)   # sum of percentages over unweighted grades
+    unweighted_count = Column(Integer, default=0)
+    graded_count = Column(Integer, default=0)
+    best_score = Column(Float)
+    worst_score = Column(Float)
+
+class StudentDataVersion(Base):
+    """
+    Monotonic per-student counter, bumped in the same transaction as any write that can
+    change that student's results. Caches key derived results on it (see data_versions.py).
+    """
+    __tablename__ = "student_data_versions"
+
+    student_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class ResourceVersion(Base):
+    """
+    Monotonic counter per listed resource ("subjects", "grades"), bumped in the same
+    transaction as any write to it. List endpoints derive their ETags from it.
+    """
+    __tablename__ = "resource_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class NotificationEvent(Base):
+    """
+    Change events shared between worker processes by the "sqlite" notification broker.
+    The id doubles as the event's sequence number; see notifications.py.
+    """
+    __tablename__ = "notification_events"
+
+    id = Column(Integer, primary_key=True)
+    created_at = Column(Float, nullable=False)
+    payload = Column(Text, nullable=False)
@@ -1,24 +1,239 @@
+"""
+Change notifications for live dashboards.
+
+`publish` hands an event to the configured broker, which gives it a sequence number and
+delivers it to the `subscribe`rs of every worker process:
+
+- "local" (default): in-process only, enough for a single worker.
+- "sqlite": events are appended in small batches to the notification_events table and
+  every worker tails that table, so all workers see every event, in the same order,
+  without any extra service. The table is pruned to the last RETENTION_ROWS events.
+
+Choose with NOTIFICATIONS_BROKER. Each worker also keeps the last REPLAY_SIZE events so
+a reconnecting client can catch up from the last sequence number it saw (`replay`).
+"""
 import asyncio
-from typing import List
+import json
+import os
+import time
+import traceback
+from collections import deque
+from typing import Callable, Deque, List, Optional, Tuple
+from sqlalchemy import delete, func, insert, select
+from database import async_engine, async_read_engine
+import models
+
+# Events buffered per subscriber before new ones are dropped for that subscriber
+MAX_QUEUE_SIZE = 100
+BROKER = os.getenv("NOTIFICATIONS_BROKER", "local")
+REPLAY_SIZE = int(os.getenv("NOTIFICATIONS_REPLAY_SIZE", "1000"))
+# sqlite broker: how long publishes are collected into one insert, how often other
+# workers' events are polled for, and how many events the table keeps
+BATCH_WINDOW_SECONDS = float(os.getenv("NOTIFICATIONS_BATCH_WINDOW_MS", "20")) / 1000
+POLL_INTERVAL_SECONDS = float(os.getenv("NOTIFICATIONS_POLL_INTERVAL_MS", "200")) / 1000
+RETENTION_ROWS = int(os.getenv("NOTIFICATIONS_RETENTION_ROWS", "10000"))
+TAIL_BATCH_SIZE = 500
+
+class Subscription:
+    """
+    A subscriber's bounded queue of (sequence number, event). `accepts` decides which
+    published events are relevant to it; events that arrive while the queue is full (or
+    that this worker missed) are counted in `dropped` so the client can be told to refetch.
+    """
+    def __init__(self, accepts: Optional[Callable[[dict], bool]] = None, maxsize: int = MAX_QUEUE_SIZE):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.accepts = accepts
+        self.dropped = 0
 
-_subscribers: List[asyncio.Queue] = []
+    async def get(self) -> Tuple[int, dict]:
+        return await self.queue.get()
 
-def subscribe():
-    q = asyncio.Queue()
-    _subscribers.append(q)
-    return q
+_subscribers: List[Subscription] = []
+_stats = {"published": 0, "delivered": 0, "dropped": 0, "gaps": 0}
+_replay: Deque[Tuple[int, dict]] = deque(maxlen=REPLAY_SIZE)
+_last_seq = 0
 
-def unsubscribe(q):
+def subscribe(accepts: Optional[Callable[[dict], bool]] = None, maxsize: int = MAX_QUEUE_SIZE) -> Subscription:
+    sub = Subscription(accepts, maxsize)
+    _subscribers.append(sub)
+    return sub
+
+def unsubscribe(sub):
     try:
-        _subscribers.remove(q)
+        _subscribers.remove(sub)
     except ValueError:
         pass
 
-async def publish(message: dict):
-    # push message to all subscriber queues (non-blocking)
-    for q in list(_subscribers):
+def _dispatch(seq: int, message: dict):
+    # push message to every interested subscriber queue (non-blocking)
+    global _last_seq
+    _last_seq = seq
+    _replay.append((seq, message))
+    _stats["published"] += 1
+    for sub in list(_subscribers):
         try:
-            q.put_nowait(message)
+            if sub.accepts is not None and not sub.accepts(message):
+                continue
+            sub.queue.put_nowait((seq, message))
+            _stats["delivered"] += 1
+        except asyncio.QueueFull:
+            sub.dropped += 1
+            _stats["dropped"] += 1
         except Exception:
-            # if queue full or error, skip
+            # a broken filter must not stop delivery to everyone else
             pass
+
+def _report_gap():
+    """This worker missed events; every subscriber has to resync."""
+    _stats["gaps"] += 1
+    for sub in list(_subscribers):
+        sub.dropped += 1
+
+def replay(after_seq: int) -> Optional[List[Tuple[int, dict]]]:
+    """
+    Events with a sequence number above `after_seq`, oldest first, or None if some of
+    them are no longer buffered (or `after_seq` is unknown here) and the client must refetch.
+    """
+    if after_seq == _last_seq:
+        return []
+    if after_seq > _last_seq or not _replay or _replay[0][0] > after_seq + 1:
+        return None
+    return [(seq, message) for seq, message in _replay if seq > after_seq]
+
+class LocalBroker:
+    name = "local"
+
+    def __init__(self):
+        self._seq = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, message: dict):
+        self._seq += 1
+        _dispatch(self._seq, message)
+
+Event = models.NotificationEvent
+
+class SQLiteBroker:
+    name = "sqlite"
+
+    def __init__(self):
+        self._pending: List[dict] = []
+        self._tasks: List[asyncio.Task] = []
+        self._wake_writer: Optional[asyncio.Event] = None
+        self._wake_tailer: Optional[asyncio.Event] = None
+
+    async def start(self):
+        if self._wake_writer is not None:
+            return
+        self._wake_writer = asyncio.Event()
+        self._wake_tailer = asyncio.Event()
+        await self._preload()
+        self._tasks = [asyncio.create_task(self._write_loop()), asyncio.create_task(self._tail_loop())]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._wake_writer = self._wake_tailer = None
+        await self._flush()
+
+    async def publish(self, message: dict):
+        await self.start()
+        self._pending.append(message)
+        self._wake_writer.set()
+
+    async def _preload(self):
+        # Start tailing at the current end, with the recent past available for replay
+        global _last_seq
+        async with async_read_engine.connect() as conn:
+            rows = (await conn.execute(
+                select(Event.id, Event.payload).order_by(Event.id.desc()).limit(REPLAY_SIZE)
+            )).all()
+        for seq, payload in reversed(rows):
+            _replay.append((seq, json.loads(payload)))
+        if rows:
+            _last_seq = max(_last_seq, rows[0][0])
+
+    async def _write_loop(self):
+        while True:
+            await self._wake_writer.wait()
+            # let a burst of publishes share one insert
+            await asyncio.sleep(BATCH_WINDOW_SECONDS)
+            self._wake_writer.clear()
+            try:
+                await self._flush()
+            except Exception:
+                traceback.print_exc()
+                await asyncio.sleep(POLL_INTERVAL_SECONDS)
+                self._wake_writer.set()
+
+    async def _flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            now = time.time()
+            async with async_engine.begin() as conn:
+                previous = (await conn.execute(select(func.max(Event.id)))).scalar() or 0
+                await conn.execute(insert(Event), [{"created_at": now, "payload": json.dumps(m)} for m in batch])
+                newest = (await conn.execute(select(func.max(Event.id)))).scalar()
+                # never prune the batch just written, however large, before anyone has read it
+                await conn.execute(delete(Event).where(Event.id <= min(newest - RETENTION_ROWS, previous)))
+        except Exception:
+            # keep the events for the next attempt
+            self._pending[:0] = batch
+            raise
+        if self._wake_tailer is not None:
+            self._wake_tailer.set()
+
+    async def _tail_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake_tailer.wait(), timeout=POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wake_tailer.clear()
+            try:
+                await self._poll()
+            except Exception:
+                traceback.print_exc()
+
+    async def _poll(self):
+        while True:
+            async with async_read_engine.connect() as conn:
+                rows = (await conn.execute(
+                    select(Event.id, Event.payload).where(Event.id > _last_seq).order_by(Event.id).limit(TAIL_BATCH_SIZE)
+                )).all()
+            for seq, payload in rows:
+                # compared against the preload baseline too, even when that was an empty table
+                if seq != _last_seq + 1:
+                    # pruned before this worker read them
+                    _report_gap()
+                _dispatch(seq, json.loads(payload))
+            if len(rows) < TAIL_BATCH_SIZE:
+                return
+
+_brokers = {"local": LocalBroker, "sqlite": SQLiteBroker}
+if BROKER not in _brokers:
+    raise ValueError(f"NOTIFICATIONS_BROKER must be one of {sorted(_brokers)}, not {BROKER!r}")
+_broker = _brokers[BROKER]()
+
+async def start():
+    """Start the broker's background tasks; call once per worker at startup."""
+    await _broker.start()
+
+async def stop():
+    """Flush pending events and stop the background tasks; call at shutdown."""
+    await _broker.stop()
+
+async def publish(message: dict):
+    await _broker.publish(message)
+
+def stats() -> dict:
+    return {**_stats, "subscribers": len(_subscribers), "broker": _broker.name, "last_seq": _last_seq}
@@ -0,0 +1,69 @@
+"""
+Set-based removal of grades whose assessment is gone.
+
+Grades reference assessments without ON DELETE CASCADE (SQLite can't add one to an
+existing table), so deleting assessments has to delete their grades explicitly. Large
+deletes run in chunks of CHUNK_SIZE rows, each in its own short transaction, so other
+writers get the database between chunks. Callers keep the assessment rows until the last
+chunk is gone: SQLite hands the highest deleted id to the next insert, so an assessment
+deleted early could come back as a new one and inherit (then lose) the pending grades.
+
+Run `python orphans.py` once to purge grades orphaned by older versions of the app.
+"""
+import asyncio
+import os
+from typing import Awaitable, Callable, Iterable, Optional
+from sqlalchemy import delete, exists, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+import data_versions
+import models
+
+CHUNK_SIZE = int(os.getenv("DELETE_CHUNK_SIZE", "5000"))
+
+Grade = models.Grade
+
+def _grades_query(assessment_ids: Optional[Iterable[int]]):
+    """Grades of the given assessments, or with None, grades whose assessment no longer exists."""
+    query = select(Grade.id, Grade.student_id)
+    if assessment_ids is not None:
+        return query.where(Grade.assessment_id.in_(list(assessment_ids)))
+    return query.where(~exists().where(models.Assessment.id == Grade.assessment_id))
+
+async def delete_grades_chunk(db: AsyncSession, assessment_ids: Optional[Iterable[int]] = None, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Delete up to `chunk_size` grades (see `_grades_query`) in the caller's transaction and
+    bump the affected students' data versions. Returns the number deleted.
+    """
+    rows = (await db.execute(_grades_query(assessment_ids).limit(chunk_size))).all()
+    if not rows:
+        return 0
+    await db.execute(delete(Grade).where(Grade.id.in_([grade_id for grade_id, _ in rows])))
+    await data_versions.bump_students(db, {student_id for _, student_id in rows if student_id is not None})
+    await data_versions.bump_resources(db, "grades")
+    return len(rows)
+
+async def delete_grades(assessment_ids: Optional[Iterable[int]] = None, chunk_size: int = CHUNK_SIZE,
+                        finish: Optional[Callable[[AsyncSession], Awaitable[None]]] = None) -> int:
+    """
+    Delete every matching grade, one committed chunk at a time. Returns the total deleted.
+    `finish` runs in the last chunk's transaction, e.g. to delete the assessments themselves.
+    """
+    assessment_ids = None if assessment_ids is None else list(assessment_ids)
+    total = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            deleted = await delete_grades_chunk(db, assessment_ids, chunk_size)
+            if deleted < chunk_size and finish is not None:
+                await finish(db)
+            await db.commit()
+        total += deleted
+        if deleted < chunk_size:
+            return total
+        # let queued requests at the database before the next chunk
+        await asyncio.sleep(0)
+
+if __name__ == "__main__":
+    import migrations
+    migrations.run_migrations()
+    print(f"Purged {asyncio.run(delete_grades())} orphaned grades.")
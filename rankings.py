@@ -0,0 +1,113 @@
+"""
+Per-subject cohort ranking index.
+
+Each subject keeps its students' current percentages (from the per-subject aggregates)
+in a sorted list, so rank, percentile and histogram lookups are binary searches and
+top-k is a slice. Indexes are loaded lazily, updated in place after grade writes in this
+process, and reloaded after INDEX_TTL_SECONDS to pick up writes made by other workers.
+"""
+import bisect
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+import logic
+
+INDEX_TTL_SECONDS = float(os.getenv("RANK_INDEX_TTL_SECONDS", "60"))
+
+Aggregate = models.StudentSubjectAggregate
+
+def _subject_percentage(row) -> float:
+    return logic.blend_breakdown(
+        row.weighted_sum, row.weight_sum, row.unweighted_sum, row.unweighted_count, row.graded_count
+    )['percentage']
+
+class SubjectRankIndex:
+    def __init__(self, scores: Dict[int, float]):
+        self.loaded_at = time.monotonic()
+        self._by_student = dict(scores)
+        # ascending (percentage, student_id); ties keep a deterministic order
+        self._sorted: List[Tuple[float, int]] = sorted((score, sid) for sid, score in scores.items())
+        self._values: List[float] = [score for score, _ in self._sorted]
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def update(self, student_id: int, score: Optional[float]):
+        """Set (or with None, remove) one student's score."""
+        old = self._by_student.pop(student_id, None)
+        if old is not None:
+            i = bisect.bisect_left(self._sorted, (old, student_id))
+            del self._sorted[i]
+            del self._values[i]
+        if score is not None:
+            self._by_student[student_id] = score
+            i = bisect.bisect_left(self._sorted, (score, student_id))
+            self._sorted.insert(i, (score, student_id))
+            self._values.insert(i, score)
+
+    def score_of(self, student_id: int) -> Optional[float]:
+        return self._by_student.get(student_id)
+
+    def rank(self, score: float) -> int:
+        """1-based competition rank: one more than the number of strictly higher scores."""
+        return len(self._values) - bisect.bisect_right(self._values, score) + 1
+
+    def percentile(self, score: float) -> float:
+        """Percentage of the cohort scoring at or below `score`."""
+        if not self._values:
+            return 0.0
+        return round(100.0 * bisect.bisect_right(self._values, score) / len(self._values), 2)
+
+    def top(self, k: int) -> List[Tuple[int, float]]:
+        """(student_id, percentage) for the k highest scores, best first."""
+        return [(sid, score) for score, sid in reversed(self._sorted[-k:])] if k > 0 else []
+
+    def histogram(self, bins: int = 10, low: float = 0.0, high: float = 100.0) -> List[dict]:
+        """Counts per equal-width bin over [low, high]; the last bin includes `high`."""
+        width = (high - low) / bins
+        edges = [low + i * width for i in range(bins + 1)]
+        counts = []
+        for i in range(bins):
+            lo = bisect.bisect_left(self._values, edges[i]) if i > 0 else 0
+            hi = bisect.bisect_left(self._values, edges[i + 1]) if i < bins - 1 else len(self._values)
+            counts.append({"lower": round(edges[i], 2), "upper": round(edges[i + 1], 2), "count": hi - lo})
+        return counts
+
+_indexes: Dict[int, SubjectRankIndex] = {}
+
+async def _load(db: AsyncSession, subject_id: int) -> SubjectRankIndex:
+    result = await db.execute(select(Aggregate).where(Aggregate.subject_id == subject_id))
+    return SubjectRankIndex({row.student_id: _subject_percentage(row) for row in result.scalars().all()})
+
+async def get_index(db: AsyncSession, subject_id: int) -> SubjectRankIndex:
+    index = _indexes.get(subject_id)
+    if index is None or time.monotonic() - index.loaded_at > INDEX_TTL_SECONDS:
+        index = await _load(db, subject_id)
+        _indexes[subject_id] = index
+    return index
+
+async def refresh_students(db: AsyncSession, subject_ids: Iterable[int], student_ids: Iterable[int]):
+    """
+    Re-read the given students' aggregates into any loaded index for these subjects.
+    Call after the grade write has been committed.
+    """
+    subject_ids = [sid for sid in set(subject_ids) if sid in _indexes]
+    student_ids = set(student_ids)
+    if not subject_ids or not student_ids:
+        return
+    result = await db.execute(
+        select(Aggregate).where(Aggregate.subject_id.in_(subject_ids), Aggregate.student_id.in_(student_ids))
+    )
+    found = {(row.subject_id, row.student_id): _subject_percentage(row) for row in result.scalars().all()}
+    for subject_id in subject_ids:
+        index = _indexes.get(subject_id)
+        if index is None:
+            continue
+        for student_id in student_ids:
+            index.update(student_id, found.get((subject_id, student_id)))
+
+def drop_subject(subject_id: int):
+    _indexes.pop(subject_id, None)
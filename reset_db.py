@@ -11,7 +11,11 @@ if SQLALCHEMY_DATABASE_URL.startswith("sqlite:///"):
 if __name__ == '__main__':
     if DB_PATH and os.path.exists(DB_PATH):
         print(f"Removing existing database file: {DB_PATH}")
-        os.remove(DB_PATH)
+        engine.dispose()
+        # WAL mode keeps side files next to the database; drop them with it
+        for path in (DB_PATH, DB_PATH + "-wal", DB_PATH + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
     else:
         print("No existing database file found; creating new one.")
 
@@ -6,8 +6,16 @@ import sys
 import shutil
 import importlib.util
 
+def _backend_command(reload: bool):
+    # Production server (migrations once, then prefork workers) unless --reload asks for
+    # the single-process development server.
+    if reload:
+        return [sys.executable, "-m", "uvicorn", "main:app", "--reload", "--host", "0.0.0.0", "--port", "8000"]
+    return [sys.executable, "serve.py", "--host", "0.0.0.0", "--port", "8000"]
+
 def main():
     print("Starting Student Performance Chatbot System...")
+    reload = "--reload" in sys.argv[1:]
 
     # Paths
     project_root = os.path.dirname(os.path.abspath(__file__))
@@ -20,8 +28,11 @@ def main():
     # Start Backend
     print("Launching Backend (FastAPI)...")
     try:
+        if reload:
+            # The development server doesn't apply migrations itself
+            subprocess.check_call([sys.executable, "migrations.py"], cwd=backend_dir)
         backend_process = subprocess.Popen(
-            [sys.executable, "-m", "uvicorn", "main:app", "--reload", "--host", "0.0.0.0", "--port", "8000"],
+            _backend_command(reload),
             cwd=backend_dir,
             shell=False
         )
@@ -42,7 +53,7 @@ def main():
                     subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", reqs])
                     print("Requirements installed. Retrying backend start...")
                     backend_process = subprocess.Popen(
-                        [sys.executable, "-m", "uvicorn", "main:app", "--reload", "--host", "0.0.0.0", "--port", "8000"],
+                        _backend_command(reload),
                         cwd=backend_dir,
                         shell=False
                     )
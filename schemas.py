@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 from enum import Enum
 
 class UserRole(str, Enum):
@@ -54,6 +54,15 @@ class Assessment(AssessmentBase):
     class Config:
         from_attributes = True
 
+class AssessmentUpdate(AssessmentBase):
+    id: int
+
+class AssessmentCloneRequest(BaseModel):
+    # copy every assessment of this subject...
+    source_subject_id: int
+    # ...into each of these subjects
+    target_subject_ids: List[int]
+
 class GradeBase(BaseModel):
     score: float
     # use matriculation/student number (11-digit string) in APIs instead of numeric DB id
@@ -69,12 +78,30 @@ class Grade(GradeBase):
     class Config:
         from_attributes = True
 
+class BulkGradeError(BaseModel):
+    # 1-based data row number within the uploaded file (header excluded)
+    row: int
+    error: str
+
+class BulkGradeResult(BaseModel):
+    received: int
+    # rows written, whether as new grades or as updates to existing ones
+    inserted: int
+    errors: List[BulkGradeError]
+
 class ChatRequest(BaseModel):
     message: str
 
 class ChatResponse(BaseModel):
     response: str
 
+class ChatBatchRequest(BaseModel):
+    messages: List[str]
+
+class ChatBatchResponse(BaseModel):
+    # answers in the same order as the request's messages
+    responses: List[str]
+
 
 class GpaResponse(BaseModel):
     gpa: float
@@ -83,3 +110,37 @@ class GpaResponse(BaseModel):
     graded_assessments: int
     class Config:
         from_attributes = True
+
+class CohortGpaResponse(GpaResponse):
+    student_id: int
+    student_number: Optional[str] = None
+
+class RankResponse(BaseModel):
+    subject_id: int
+    student_number: Optional[str] = None
+    percentage: float
+    rank: int
+    cohort_size: int
+    # share of the cohort (0-100) scoring at or below this student
+    percentile: float
+
+class RankEntry(BaseModel):
+    rank: int
+    student_number: Optional[str] = None
+    percentage: float
+
+class HistogramBin(BaseModel):
+    lower: float
+    upper: float
+    count: int
+
+class GradePlanRow(BaseModel):
+    subject_id: int
+    subject_name: str
+    subject_code: str
+    current_points: float
+    completed_weight: float
+    remaining_weight: float
+    # letter -> average % needed on the remaining weight (None once nothing remains);
+    # above 100 is out of reach, below 0 is already secured
+    required: Dict[str, Optional[float]]
@@ -6,6 +6,8 @@ from sqlalchemy.orm import Session
 from database import SessionLocal, engine
 import models
 import auth
+import aggregates
+import data_versions
 
 def seed_database():
     db = SessionLocal()
@@ -147,6 +149,10 @@ def seed_database():
         ]
         
         db.add_all(grades)
+        db.flush()
+        aggregates.rebuild(db)
+        data_versions.bump_all_graded(db)
+        data_versions.bump_all_resources(db)
         db.commit()
         print(f"✓ Created {len(grades)} sample grades for student: {student.username}")
         
@@ -174,6 +180,9 @@ def clear_database():
         # The order of deletion is important to avoid foreign key violations.
         # We delete in the reverse order of creation.
 
+        db.query(models.StudentSubjectAggregate).delete()
+        data_versions.bump_all_graded(db)
+        data_versions.bump_all_resources(db)
         num_grades = db.query(models.Grade).delete()
         num_assessments = db.query(models.Assessment).delete()
         num_subjects = db.query(models.Subject).delete()
@@ -0,0 +1,39 @@
+"""
+Production entry point.
+
+Applies migrations once, then starts N uvicorn worker processes sharing one listening
+socket, without auto-reload. Workers import the app without touching the schema, warm up
+in the lifespan hook, and report ready on GET /ready.
+
+Usage: python serve.py [--workers N] [--host HOST] [--port PORT] [--skip-migrations]
+Worker count defaults to WEB_CONCURRENCY, or the number of CPU cores.
+"""
+import argparse
+import os
+import uvicorn
+
+def default_workers() -> int:
+    if os.getenv("WEB_CONCURRENCY"):
+        return int(os.getenv("WEB_CONCURRENCY"))
+    return os.cpu_count() or 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with prefork workers.")
+    parser.add_argument("--workers", type=int, default=default_workers())
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--skip-migrations", action="store_true", help="the schema is already up to date")
+    args = parser.parse_args()
+
+    if not args.skip_migrations:
+        import migrations
+        migrations.run_migrations()
+
+    if args.workers > 1:
+        # In-process notifications would only reach clients of the publishing worker
+        os.environ.setdefault("NOTIFICATIONS_BROKER", "sqlite")
+
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, proxy_headers=True)
+
+if __name__ == "__main__":
+    main()
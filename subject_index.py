@@ -0,0 +1,126 @@
+"""
+Process-local subject lookup for the chatbot.
+
+Subject names and codes are held in memory with an exact code map and a trigram index
+over names, so resolving "physics", "PHYS101" or a misspelling like "phisics" needs no
+database round trip. The index is loaded at startup, patched in place by the subject
+endpoints in this process, and reloaded after INDEX_TTL_SECONDS to pick up changes made
+by other workers.
+"""
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Set
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import models
+
+INDEX_TTL_SECONDS = float(os.getenv("SUBJECT_INDEX_TTL_SECONDS", "60"))
+# Minimum share of the query's trigrams a name must contain to count as a fuzzy match
+MIN_SIMILARITY = 0.5
+
+class SubjectEntry(NamedTuple):
+    id: int
+    name: str
+    code: str
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {' '.join(text.lower().split())} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SubjectIndex:
+    def __init__(self, subjects: List[SubjectEntry] = ()):
+        self.loaded_at = time.monotonic()
+        self._by_id: Dict[int, SubjectEntry] = {}
+        self._by_code: Dict[str, int] = {}
+        self._grams: Dict[int, Set[str]] = {}
+        self._postings: Dict[str, Set[int]] = defaultdict(set)
+        for subject in subjects:
+            self.put(subject)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def put(self, subject: SubjectEntry):
+        """Add or replace one subject."""
+        self.remove(subject.id)
+        self._by_id[subject.id] = subject
+        self._by_code[subject.code.lower()] = subject.id
+        grams = trigrams(subject.name)
+        self._grams[subject.id] = grams
+        for gram in grams:
+            self._postings[gram].add(subject.id)
+
+    def remove(self, subject_id: int):
+        old = self._by_id.pop(subject_id, None)
+        if old is None:
+            return
+        if self._by_code.get(old.code.lower()) == subject_id:
+            del self._by_code[old.code.lower()]
+        for gram in self._grams.pop(subject_id):
+            ids = self._postings[gram]
+            ids.discard(subject_id)
+            if not ids:
+                del self._postings[gram]
+
+    def search(self, name_part: str, code_part: Optional[str] = None) -> List[SubjectEntry]:
+        """
+        An exact code match for `code_part` (default: `name_part`), otherwise subjects whose
+        name contains `name_part` or whose code contains `code_part`, case-insensitively and
+        in id order. When nothing matches that way, the closest names by trigram similarity
+        are returned instead.
+        """
+        name_part = name_part.lower().strip()
+        code_part = (code_part if code_part is not None else name_part).lower().strip()
+        exact = self._by_code.get(code_part)
+        if exact is not None:
+            return [self._by_id[exact]]
+        found = [
+            subject for subject in self._by_id.values()
+            if (name_part and name_part in subject.name.lower()) or (code_part and code_part in subject.code.lower())
+        ]
+        if found:
+            return sorted(found, key=lambda s: s.id)
+        return self.fuzzy(name_part)
+
+    def fuzzy(self, phrase: str) -> List[SubjectEntry]:
+        """
+        The closest subject names for `phrase` (ties included), if similar enough. Names are
+        scored by the share of the phrase's trigrams they contain, so a misspelt word still
+        matches inside a longer name; Dice similarity breaks ties in favour of tighter names.
+        """
+        grams = trigrams(phrase)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for subject_id in self._postings.get(gram, ()):
+                shared[subject_id] += 1
+        best, matches = (MIN_SIMILARITY, 0.0), []
+        for subject_id, count in shared.items():
+            score = (count / len(grams), 2 * count / (len(grams) + len(self._grams[subject_id])))
+            if score > best:
+                best, matches = score, [subject_id]
+            elif score == best and matches:
+                matches.append(subject_id)
+        return [self._by_id[subject_id] for subject_id in sorted(matches)]
+
+_index: Optional[SubjectIndex] = None
+
+async def load(db: AsyncSession) -> SubjectIndex:
+    global _index
+    result = await db.execute(select(models.Subject.id, models.Subject.name, models.Subject.code))
+    _index = SubjectIndex([SubjectEntry(*row) for row in result.all()])
+    return _index
+
+async def get_index(db: AsyncSession) -> SubjectIndex:
+    if _index is None or time.monotonic() - _index.loaded_at > INDEX_TTL_SECONDS:
+        return await load(db)
+    return _index
+
+def put(subject: models.Subject):
+    """Reflect a committed create or update; a no-op until the index has been loaded."""
+    if _index is not None:
+        _index.put(SubjectEntry(subject.id, subject.name, subject.code))
+
+def remove(subject_id: int):
+    if _index is not None:
+        _index.remove(subject_id)
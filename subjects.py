@@ -1,11 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 
 import models
 import schemas
 import auth
-from database import get_db
+import aggregates
+import data_versions
+import etags
+import notifications
+import orphans
+import rankings
+import subject_index
+from database import get_async_db, get_async_read_db
 
 router = APIRouter(
     prefix="/subjects",
@@ -22,47 +30,136 @@ def require_lecturer(current_user: models.User = Depends(auth.get_current_user))
     return current_user
 
 @router.post("/", response_model=schemas.Subject, status_code=status.HTTP_201_CREATED)
-def create_subject(subject: schemas.SubjectCreate, db: Session = Depends(get_db), current_user: models.User = Depends(require_lecturer)):
-    db_subject = db.query(models.Subject).filter(models.Subject.code == subject.code).first()
-    if db_subject:
+async def create_subject(subject: schemas.SubjectCreate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(require_lecturer)):
+    result = await db.execute(select(models.Subject).where(models.Subject.code == subject.code))
+    if result.scalars().first():
         raise HTTPException(status_code=400, detail="Subject with this code already exists")
     
     db_subject = models.Subject(name=subject.name, code=subject.code)
     db.add(db_subject)
-    db.commit()
-    db.refresh(db_subject)
+    await data_versions.bump_resources(db, "subjects")
+    await db.commit()
+    subject_index.put(db_subject)
+    await notifications.publish({"type": "subject.created", "subject_id": db_subject.id})
     return db_subject
 
 @router.get("/", response_model=List[schemas.Subject])
-def get_all_subjects(db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_user)):
-    subjects = db.query(models.Subject).all()
-    return subjects
+async def get_all_subjects(request: Request, response: Response, db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(auth.get_current_user)):
+    # Dashboards poll this; an unchanged list costs one version lookup and a 304
+    etag = etags.make_etag("subjects", await data_versions.get_resource_version(db, "subjects"))
+    if etags.matches(request, etag):
+        return etags.not_modified(etag)
+    result = await db.execute(select(models.Subject))
+    etags.tag(response, etag)
+    return result.scalars().all()
 
 @router.put("/{subject_id}", response_model=schemas.Subject)
-def update_subject(subject_id: int, subject: schemas.SubjectCreate, db: Session = Depends(get_db), current_user: models.User = Depends(require_lecturer)):
-    db_subject = db.query(models.Subject).filter(models.Subject.id == subject_id).first()
+async def update_subject(subject_id: int, subject: schemas.SubjectCreate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(require_lecturer)):
+    db_subject = await db.get(models.Subject, subject_id)
     if not db_subject:
         raise HTTPException(status_code=404, detail="Subject not found")
     
     # Check if the new code already exists
-    if db.query(models.Subject).filter(models.Subject.code == subject.code, models.Subject.id != subject_id).first():
+    result = await db.execute(select(models.Subject).where(models.Subject.code == subject.code, models.Subject.id != subject_id))
+    if result.scalars().first():
         raise HTTPException(status_code=400, detail="Subject with this code already exists")
 
+    if (db_subject.name, db_subject.code) != (subject.name, subject.code):
+        # cached summaries and chat answers quote the subject's name and code
+        await data_versions.bump_subject(db, subject_id)
     db_subject.name = subject.name
     db_subject.code = subject.code
-    db.commit()
-    db.refresh(db_subject)
+    await data_versions.bump_resources(db, "subjects")
+    await db.commit()
+    subject_index.put(db_subject)
+    await notifications.publish({"type": "subject.updated", "subject_id": subject_id})
     return db_subject
 
 @router.delete("/{subject_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_subject(subject_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(require_lecturer)):
-    db_subject = db.query(models.Subject).filter(models.Subject.id == subject_id).first()
+async def delete_subject(subject_id: int, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(require_lecturer)):
+    """
+    Deletes the subject with its assessments and their grades. Up to DELETE_CHUNK_SIZE
+    grades go in the same transaction; any beyond that are deleted in chunks after the
+    response, so a very large subject doesn't hold the write lock for long. In that case
+    the subject and its assessments are deleted with the last chunk (see orphans.py).
+    """
+    db_subject = await db.get(models.Subject, subject_id)
     if not db_subject:
         raise HTTPException(status_code=404, detail="Subject not found")
 
-    # Also delete associated assessments and grades
-    db.query(models.Assessment).filter(models.Assessment.subject_id == subject_id).delete()
-    
-    db.delete(db_subject)
-    db.commit()
+    result = await db.execute(select(models.Assessment.id).where(models.Assessment.subject_id == subject_id))
+    assessment_ids = result.scalars().all()
+    await data_versions.bump_subject(db, subject_id)
+    deleted = await orphans.delete_grades_chunk(db, assessment_ids)
+    if deleted == orphans.CHUNK_SIZE:
+        await aggregates.refresh(db, subject_ids=[subject_id])
+        await db.commit()
+        background_tasks.add_task(_finish_delete_subject, subject_id, assessment_ids)
+        return
+    await _delete_subject_rows(db, subject_id)
+    await db.commit()
+    await _subject_deleted(subject_id)
     return
+
+async def _delete_subject_rows(db: AsyncSession, subject_id: int):
+    # the caller has deleted every grade of the subject's assessments
+    await db.execute(delete(models.Assessment).where(models.Assessment.subject_id == subject_id))
+    await aggregates.refresh(db, subject_ids=[subject_id])
+    await db.execute(delete(models.Subject).where(models.Subject.id == subject_id))
+    await data_versions.bump_resources(db, "subjects", "grades")
+
+async def _subject_deleted(subject_id: int):
+    rankings.drop_subject(subject_id)
+    subject_index.remove(subject_id)
+    await notifications.publish({"type": "subject.deleted", "subject_id": subject_id})
+
+async def _finish_delete_subject(subject_id: int, assessment_ids: List[int]):
+    await orphans.delete_grades(assessment_ids, finish=lambda db: _delete_subject_rows(db, subject_id))
+    await _subject_deleted(subject_id)
+
+async def _rank_of(db: AsyncSession, subject_id: int, student: models.User) -> schemas.RankResponse:
+    index = await rankings.get_index(db, subject_id)
+    percentage = index.score_of(student.id)
+    if percentage is None:
+        raise HTTPException(status_code=404, detail="No grades recorded for this student in this subject")
+    return schemas.RankResponse(
+        subject_id=subject_id,
+        student_number=student.student_number,
+        percentage=percentage,
+        rank=index.rank(percentage),
+        cohort_size=len(index),
+        percentile=index.percentile(percentage)
+    )
+
+@router.get("/{subject_id}/rankings/me", response_model=schemas.RankResponse)
+async def get_my_rank(subject_id: int, db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(auth.get_current_user)):
+    """The current student's rank and percentile in a subject."""
+    return await _rank_of(db, subject_id, current_user)
+
+@router.get("/{subject_id}/rankings/students/{student_number}", response_model=schemas.RankResponse)
+async def get_student_rank(subject_id: int, student_number: str, db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(require_lecturer)):
+    result = await db.execute(select(models.User).where(models.User.student_number == student_number))
+    student = result.scalars().first()
+    if not student:
+        raise HTTPException(status_code=404, detail=f"Student with number {student_number} not found")
+    return await _rank_of(db, subject_id, student)
+
+@router.get("/{subject_id}/rankings/top", response_model=List[schemas.RankEntry])
+async def get_top_students(subject_id: int, k: int = Query(10, ge=1, le=500), db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(require_lecturer)):
+    index = await rankings.get_index(db, subject_id)
+    top = index.top(k)
+    numbers = {}
+    if top:
+        result = await db.execute(
+            select(models.User.id, models.User.student_number).where(models.User.id.in_([sid for sid, _ in top]))
+        )
+        numbers = dict(result.all())
+    return [
+        schemas.RankEntry(rank=index.rank(percentage), student_number=numbers.get(sid), percentage=percentage)
+        for sid, percentage in top
+    ]
+
+@router.get("/{subject_id}/rankings/histogram", response_model=List[schemas.HistogramBin])
+async def get_score_histogram(subject_id: int, bins: int = Query(10, ge=1, le=100), db: AsyncSession = Depends(get_async_read_db), current_user: models.User = Depends(require_lecturer)):
+    index = await rankings.get_index(db, subject_id)
+    return index.histogram(bins)
@@ -0,0 +1,107 @@
+"""
+Regression test for the chatbot's grades answer: however many subjects match, it must be
+built from exactly one SQL statement. Run with `python -m pytest test_chatbot.py`.
+"""
+import asyncio
+import os
+import tempfile
+import pytest
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import Session
+
+import chatbot
+import models
+import subject_index
+from database import make_async_engine, make_engine
+
+@pytest.fixture
+def db_url():
+    with tempfile.TemporaryDirectory() as tmp:
+        url = "sqlite:///" + os.path.join(tmp, "chatbot.db")
+        engine = make_engine(url)
+        models.Base.metadata.create_all(bind=engine)
+        with Session(engine) as db:
+            student = models.User(username="s1", role="student", student_number="S1")
+            other = models.User(username="s2", role="student", student_number="S2")
+            maths = models.Subject(name="Mathematics", code="MATH101")
+            physics = models.Subject(name="Physics", code="PHYS101")
+            applied = models.Subject(name="Applied Physics", code="PHYS201")
+            history = models.Subject(name="History", code="HIST101")
+            db.add_all([student, other, maths, physics, applied, history])
+            db.flush()
+            midterm = models.Assessment(subject_id=maths.id, name="Midterm", max_score=100, weight=40)
+            final = models.Assessment(subject_id=maths.id, name="Final", max_score=100, weight=60)
+            lab = models.Assessment(subject_id=physics.id, name="Lab", max_score=100, weight=30)
+            exam = models.Assessment(subject_id=applied.id, name="Exam", max_score=100, weight=100)
+            db.add_all([midterm, final, lab, exam])
+            db.flush()
+            db.add_all([
+                models.Grade(student_id=student.id, assessment_id=midterm.id, score=85),
+                models.Grade(student_id=student.id, assessment_id=final.id, score=92),
+                models.Grade(student_id=student.id, assessment_id=exam.id, score=55),
+                # another student's grade must not leak into the answer
+                models.Grade(student_id=other.id, assessment_id=lab.id, score=99),
+            ])
+            db.commit()
+        engine.dispose()
+        yield url
+
+def ask(url: str, query: str):
+    """Answer `query` as student S1; returns (answer, SQL statements issued while answering)."""
+    async def run():
+        engine = make_async_engine(url)
+        statements = []
+        try:
+            async with async_sessionmaker(engine, class_=AsyncSession)() as db:
+                await subject_index.load(db)
+                student_id = (await db.execute(select(models.User.id).where(models.User.student_number == "S1"))).scalar_one()
+                listener = lambda conn, cursor, statement, *args: statements.append(statement)
+                event.listen(engine.sync_engine, "before_cursor_execute", listener)
+                try:
+                    answer = await chatbot.process_query(query, db, student_id)
+                finally:
+                    event.remove(engine.sync_engine, "before_cursor_execute", listener)
+        finally:
+            await engine.dispose()
+        return answer, statements
+    return asyncio.run(run())
+
+def test_grades_for_one_subject_is_one_statement(db_url):
+    answer, statements = ask(db_url, "What is my grade in Mathematics?")
+    assert len(statements) == 1
+    assert answer == (
+        "**Mathematics** (MATH101):\n"
+        "- Midterm: 85.0 (B)\n"
+        "- Final: 92.0 (A)\n"
+        "Current Weighted Score: 89.2 (out of 100.0 weight so far)\n"
+    )
+
+def test_grades_for_several_subjects_is_one_statement(db_url):
+    answer, statements = ask(db_url, "grades in physics")
+    assert len(statements) == 1
+    blocks = answer.split("\n")
+    assert "**Physics**: No grades recorded yet. Assessments: Lab (30.0%)." in blocks
+    assert "**Applied Physics** (PHYS201):" in blocks
+    assert "- Exam: 55.0 (F)" in blocks
+    # one block per subject, in subject order
+    assert answer.index("**Physics**") < answer.index("**Applied Physics**")
+
+def test_grades_by_code_and_misspelling(db_url):
+    by_code, statements = ask(db_url, "grades for physics (PHYS201)")
+    assert len(statements) == 1
+    assert by_code.startswith("**Applied Physics** (PHYS201):")
+    assert "**Physics**" not in by_code
+    misspelt, statements = ask(db_url, "grades in mathematiks")
+    assert len(statements) == 1
+    assert misspelt.startswith("**Mathematics** (MATH101):")
+
+def test_grades_for_subject_without_assessments(db_url):
+    answer, statements = ask(db_url, "grades in history")
+    assert len(statements) == 1
+    assert answer == "**History**: No grades or assessments found."
+
+def test_grades_for_unknown_subject_needs_no_query(db_url):
+    answer, statements = ask(db_url, "grades in nonexistent subject xyz")
+    assert statements == []
+    assert answer == "I couldn't find any subject matching 'nonexistent subject xyz'."
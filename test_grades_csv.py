@@ -0,0 +1,75 @@
+"""
+The bulk grade import parses CSV incrementally, holding lines back until a record is
+complete. It must read every body exactly as csv.reader reads the whole body at once,
+however the body is split into chunks. Run with `python -m pytest test_grades_csv.py`.
+"""
+import asyncio
+import csv
+import io
+import random
+import pytest
+
+import grades
+
+class FakeRequest:
+    """Just enough of a Starlette request for grades._iter_rows: a content type and a chunked body."""
+    def __init__(self, body: bytes, chunk_size: int, content_type: str = "text/csv"):
+        self.headers = {"content-type": content_type}
+        self._body = body
+        self._chunk_size = chunk_size
+
+    async def stream(self):
+        for i in range(0, len(self._body), self._chunk_size):
+            yield self._body[i:i + self._chunk_size]
+
+def parse(body: bytes, chunk_size: int):
+    async def run():
+        return [row async for row in grades._iter_rows(FakeRequest(body, chunk_size))]
+    return asyncio.run(run())
+
+def expected(text: str):
+    """What _iter_rows should yield, from csv.reader over the whole text."""
+    records = [
+        values for values in csv.reader(io.StringIO(text, newline=""))
+        if values and not (len(values) == 1 and not values[0].strip())
+    ]
+    if not records:
+        return []
+    header = [h.strip() for h in records[0]]
+    rows = []
+    for row_number, values in enumerate(records[1:], start=1):
+        if len(values) != len(header):
+            rows.append((row_number, f"Expected {len(header)} columns, got {len(values)}"))
+        else:
+            rows.append((row_number, dict(zip(header, (v.strip() for v in values)))))
+    return rows
+
+CHUNK_SIZES = [1, 2, 3, 5, 8, 64, 1 << 20]
+
+CASES = {
+    "lf": 'student_number,assessment_id,score\n2201,1,50\n2202,2,60\n',
+    "crlf": 'student_number,assessment_id,score\r\n2201,1,50\r\n2202,2,60\r\n',
+    "bare cr": 'student_number,assessment_id,score\r2201,1,50\r2202,2,60\r',
+    "mixed endings": 'student_number,assessment_id,score\r\n2201,1,50\r2202,2,60\n2203,3,70',
+    "quoted newlines": 'student_number,assessment_id,score\n"22\n01",1,50\n"22\r\n02",2,"6\r0"\n',
+    "escaped quotes": 'student_number,assessment_id,score\n"22""01",1,"a,b"\n"""",2,""\n',
+    "blank lines": 'student_number,assessment_id,score\n\n2201,1,50\r\n\r\n  \n2202,2,60\n',
+    "bom and unicode": '﻿student_number,assessment_id,score\n"é\nü",1,50\n',
+    "stray quote": 'student_number,assessment_id,score\nab"c,1,50\na"b,"c\nd",60\n',
+    "unterminated quote": 'student_number,assessment_id,score\n2201,1,50\n"2202,2,60\n2203,3,70\n',
+    "wrong column count": 'student_number,assessment_id,score\n2201,1\n2202,2,60,extra\n',
+}
+
+@pytest.mark.parametrize("name", sorted(CASES))
+@pytest.mark.parametrize("chunk_size", CHUNK_SIZES)
+def test_matches_csv_reader(name, chunk_size):
+    text = CASES[name]
+    assert parse(text.encode("utf-8"), chunk_size) == expected(text.lstrip("﻿"))
+
+def test_matches_csv_reader_on_random_bodies():
+    alphabet = ["a", "b", "1", " ", ",", '"', '""', "\n", "\r", "\r\n", "é"]
+    rng = random.Random(20261018)
+    for _ in range(300):
+        text = "x,y,z\n" + "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        for chunk_size in (1, 3, 7, 1 << 20):
+            assert parse(text.encode("utf-8"), chunk_size) == expected(text), (text, chunk_size)